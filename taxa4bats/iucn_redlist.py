@@ -4,20 +4,101 @@
 # Copyright (c) 2018-present Arnold Andreasson
 # License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
 
+import os
+import time
 import pathlib
-import json
-import urllib.request
-import xlsxwriter
+import threading
+import collections
+
+import redlist_checkpoint
+import redlist_planner
+import redlist_index
+import redlist_records
+import redlist_metrics
+
+# Response cache path for the number of the first empty species list page.
+SPECIES_PAGE_END_PATH = "/species/page/end"
 
 
 class IucnRedlist(object):
     """ """
 
-    def __init__(self, api_token=None, debug=False):
-        """ """
+    def __init__(
+        self,
+        api_token=None,
+        debug=False,
+        max_workers=8,
+        api_url="https://apiv3.iucnredlist.org/api/v3",
+        cache_dirpath=None,
+        cache_ttl=365 * 24 * 3600,
+        cache_max_bytes=500 * 1024 * 1024,
+        version_ttl=24 * 3600,
+        checkpoint_filepath=None,
+        by_country_strategy="auto",
+        requests_per_second=None,
+        max_retries=5,
+        taxon_name="chiroptera",
+        taxon_filter=None,
+        metrics=None,
+    ):
+        """ The taxon filter is a dict with "class", "order" and/or "family"
+            as keys, and lists of names as values. Species matching any of
+            them are included. The taxon name is used in file and sheet names.
+            Default is the order Chiroptera.
+            Counters and timings are recorded in metrics, a
+            redlist_metrics.Metrics object, if given. With debug=True and no
+            metrics, events are printed. """
         self.api_token = api_token
         self.debug = debug
+        if debug and (metrics is None):
+            metrics = redlist_metrics.Metrics(callbacks=[redlist_metrics.print_event])
+        self.metrics = metrics
         #
+        self.taxon_name = taxon_name
+        if taxon_filter is None:
+            taxon_filter = {"order": ["CHIROPTERA"]}
+        self.taxon_filter = {
+            rank: set(name.upper() for name in names)
+            for rank, names in taxon_filter.items()
+        }
+        # Max number of concurrent requests. Use 1 for sequential requests.
+        self.max_workers = max_workers
+        # Keep-alive connections, rate limit and retries are shared by
+        # all rest_get_* calls. Only used with a token, and not imported
+        # when saved data is loaded.
+        self.http_client = None
+        if api_token:
+            import redlist_http
+
+            self.http_client = redlist_http.HttpClient(
+                api_url,
+                max_idle_connections=max(max_workers, 1),
+                max_concurrency=max(max_workers, 1),
+                requests_per_second=requests_per_second,
+                max_retries=max_retries,
+                metrics=metrics,
+            )
+        # Optional cache for raw responses, keyed by Red List version.
+        # The version itself is checked again after version_ttl seconds.
+        self.response_cache = None
+        self.version_ttl = version_ttl
+        if cache_dirpath:
+            import redlist_cache
+
+            self.response_cache = redlist_cache.ResponseCache(
+                cache_dirpath, ttl=cache_ttl, max_bytes=cache_max_bytes
+            )
+        # Optional journal of completed requests, used to resume
+        # an interrupted get_all_from_api.
+        self.checkpoint = None
+        if checkpoint_filepath:
+            self.checkpoint = redlist_checkpoint.CheckpointJournal(checkpoint_filepath)
+        # Strategy for the species by country list: "auto", "country",
+        # or "species". For "auto" the planner selects the cheapest.
+        self.by_country_strategy = by_country_strategy
+        self.planner = redlist_planner.RequestPlanner()
+        #
+        self.lazy_lock = threading.RLock()
         self.clear()
         #
         self.define_headers()
@@ -29,6 +110,9 @@ class IucnRedlist(object):
         self.chiroptera_count = 0
         self.chiroptera_dict = {}
         self.chiroptera_info_dict = {}
+        # Species info columns kept by load_all(columns=...). None if all
+        # columns are available.
+        self.info_columns = None
         self.chiroptera_checklist = {}
         #
         self.country_count = 0
@@ -36,6 +120,18 @@ class IucnRedlist(object):
         #
         self.chiroptera_by_country_count = 0
         self.chiroptera_by_country_list = []
+        #
+        self.delta_dirpath = None
+        self.delta_base = {}
+        self.delta_by_country = {}
+        self.delta_stats = {}
+        self.plan_stats = {}
+        #
+        self.index = None
+        self.statistics = None
+        self.search_index = None
+        # Datasets not yet loaded by a lazy load_all. Name: loader function.
+        self.lazy_loaders = {}
 
     def define_headers(self):
         """ """
@@ -83,6 +179,16 @@ class IucnRedlist(object):
             "amended_flag",
             "amended_reason",
         ]
+        # Fields in the species list and the matching species info fields.
+        # Species info is requested again if any of them are changed.
+        self.delta_summary_fields = {
+            "scientific_name": "scientific_name",
+            "category": "category",
+            "main_common_name": "main_common_name",
+            "family_name": "family",
+            "genus_name": "genus",
+            "taxonomic_authority": "authority",
+        }
         #
         self.country_header = [
             "isocode",
@@ -98,98 +204,374 @@ class IucnRedlist(object):
 
     def get_redlist_version(self):
         """ """
+        self.load_pending("version")
         return self.version
 
     def get_redlist_citation(self):
         """ """
+        version = self.get_redlist_version()
         citation_string = "IUCN <YEAR>. IUCN Red List of Threatened Species. Version <VERSION> <www.iucnredlist.org>"
-        citation_string = citation_string.replace("<YEAR>", self.version[0:4])
-        citation_string = citation_string.replace("<VERSION>", self.version)
+        citation_string = citation_string.replace("<YEAR>", version[0:4])
+        citation_string = citation_string.replace("<VERSION>", version)
         return citation_string
 
+    def get_chiroptera_checklist(self):
+        """ """
+        self.load_pending("checklist")
+        return self.chiroptera_checklist
+
     def get_chiroptera_info_dict(self):
         """ """
+        self.load_pending("info")
         return self.chiroptera_info_dict
 
+    def get_species_info(self, scientific_name):
+        """ Returns the species_dict for one species, or None. """
+        return self.get_chiroptera_info_dict().get(scientific_name)
+
     def get_country_dict(self):
         """ """
+        self.load_pending("countries")
         return self.country_dict
 
     def get_chiroptera_by_country_list(self):
         """ """
+        self.load_pending("by_country")
         return self.chiroptera_by_country_list
 
-    def get_all_from_api(self):
-        """ """
-        if not self.api_token:
+    def load_pending(self, *names):
+        """ Load datasets not yet loaded by a lazy load_all. All pending
+            datasets are loaded if no names are given. A loader is removed
+            when it is done, so other threads wait for it in the lock instead
+            of returning while it is running. """
+        if not self.lazy_loaders:
             return
-        #
-        self.rest_get_version()
-        #
-        self.rest_get_chiroptera_species()
-        #
-        self.rest_get_chiroptera_info()
-        #
-        self.rest_get_countries()
-        #
-        self.rest_get_chiroptera_by_country()
+        with self.lazy_lock:
+            for name in names or list(self.lazy_loaders.keys()):
+                loader = self.lazy_loaders.get(name)
+                if loader:
+                    loader()
+                    self.lazy_loaders.pop(name, None)
 
-    def save_all(self, dirpath="data"):
+    def check_info_columns(self, columns, action):
+        """ Raises ValueError if species info was loaded by load_all without
+            some of the columns needed for action. """
+        self.load_pending("info")
+        if self.info_columns is None:
+            return
+        missing = [item for item in columns if item not in self.info_columns]
+        if missing:
+            raise ValueError(
+                "Species info loaded without the columns "
+                + ", ".join(missing)
+                + " can not be used for "
+                + action
+                + ". Use load_all without columns."
+            )
+
+    def build_index(self):
+        """ Build lookup tables. Called after load_all and get_all_from_api. """
+        self.check_info_columns(redlist_index.INDEX_COLUMNS, "the index")
+        self.load_pending("info", "by_country")
+        self.index = redlist_index.RedlistIndex(
+            self.chiroptera_info_dict, self.chiroptera_by_country_list
+        )
+        self.statistics = None
+        self.search_index = None
+
+    def get_index(self):
         """ """
+        if self.index is None:
+            self.build_index()
+        return self.index
+
+    def get_species_countries(self, scientific_name):
+        """ Returns a sorted list of country isocodes for one species. """
+        species_dict = self.get_species_info(scientific_name)
+        if species_dict is None:
+            return []
+        return self.get_index().get_countries(species_dict.get("taxonid", ""))
+
+    def query_species(self, country=None, category=None, family=None):
+        """ Returns sorted scientific names for species matching all given
+            filters. Example: query_species(country="SE", category="EN"). """
+        index = self.get_index()
+        scientific_names = []
+        for taxonid in index.query(country=country, category=category, family=family):
+            species_dict = index.get_species(taxonid)
+            if species_dict is not None:
+                scientific_names.append(species_dict["scientific_name"])
+        return sorted(scientific_names)
+
+    def get_statistics(self):
+        """ Species counts per country, family and category, as
+            redlist_analytics.ThreatStatistics. Requires numpy. """
+        import redlist_analytics
+
+        if self.statistics is None:
+            self.statistics = redlist_analytics.ThreatStatistics(
+                self.get_chiroptera_info_dict(), self.get_chiroptera_by_country_list()
+            )
+        return self.statistics
+
+    def count_species(self, country=None, category=None, family=None):
+        """ Number of species matching all given filters.
+            Example: count_species(country="SE", category="EN"). """
+        return self.get_statistics().count_species(
+            country=country, category=category, family=family
+        )
+
+    def get_search_index(self, dirpath=None):
+        """ Name search index, see redlist_search. If dirpath is given, the
+            index is saved there and used again until the species info file
+            in the same directory is changed. """
+        import redlist_search
+
+        if self.search_index is not None:
+            return self.search_index
+        search_file = None
+        if dirpath:
+            search_file = self.get_taxon_path(dirpath, "_search.json.gz")
+            info_file = self.get_taxon_path(dirpath, "_info.txt")
+            if search_file.exists() and (
+                (not info_file.exists())
+                or (search_file.stat().st_mtime >= info_file.stat().st_mtime)
+            ):
+                search_index = redlist_search.SearchIndex.load(search_file)
+                if search_index.version == self.get_redlist_version():
+                    self.search_index = search_index
+                    return search_index
+        self.search_index = redlist_search.SearchIndex(
+            self.get_chiroptera_info_dict(),
+            self.get_chiroptera_by_country_list(),
+            version=self.get_redlist_version(),
+        )
+        if search_file:
+            self.search_index.save(search_file)
+        return self.search_index
+
+    def search_species(
+        self, text, limit=10, family=None, category=None, country=None, fuzzy=True
+    ):
+        """ Ranked name matches for autocomplete and misspelled names, for
+            scientific names and common names. See redlist_search.
+            Example: search_species("myotis daubentoni", country="SE"). """
+        return self.get_search_index().search(
+            text,
+            limit=limit,
+            family=family,
+            category=category,
+            country=country,
+            fuzzy=fuzzy,
+        )
+
+    def get_plan_stats(self):
+        """ Strategy, estimated and actual cost for the species by country list. """
+        return self.plan_stats
+
+    def get_delta_stats(self):
+        """ Counters from the last delta sync in get_all_from_api. """
+        return self.delta_stats
+
+    def get_all_from_api(self, resume=False, delta_dirpath=None):
+        """ Get all data from the API. If resume=True and a checkpoint journal
+            is used, work completed by an interrupted run is not done again.
+            If delta_dirpath contains files from save_all, species info is
+            only requested for added or changed species. """
+        get_all_taxa_from_api([self], resume=resume, delta_dirpaths=[delta_dirpath])
+
+    def start_api_run(self, resume=False, delta_dirpath=None):
+        """ Called by get_all_taxa_from_api before the first request. """
+        self.http_client.clear_stats()
+        # All data is replaced, also data from an earlier run or load_all.
+        # Containers from load_all(storage="sqlite") are read-only, and the
+        # SQLite store is used as index, see load_sqlite.
+        self.clear()
+        self.delta_dirpath = delta_dirpath
+        if delta_dirpath:
+            self.delta_base = self.load_delta_base(delta_dirpath)
+            self.delta_by_country = self.load_delta_by_country(delta_dirpath)
+        if self.checkpoint:
+            self.checkpoint.open(resume=resume)
+
+    def stop_api_run(self):
+        """ Called by get_all_taxa_from_api after the last request, also
+            if the run failed. """
+        self.http_client.close()
+        if self.response_cache:
+            self.response_cache.save_index()
+        if self.checkpoint:
+            self.checkpoint.close()
+
+    def finish_api_run(self):
+        """ Called by get_all_taxa_from_api when all data is received. """
+        # All done. The journal is not needed anymore.
+        if self.checkpoint:
+            self.checkpoint.remove()
+        self.build_index()
+
+    def get_run_stats(self):
+        """ Counters from the last get_all_from_api run, added to the metrics
+            report. """
+        run_stats = {
+            "http": self.get_http_stats(),
+            "plan": self.plan_stats,
+            "species": self.chiroptera_count,
+        }
+        if self.response_cache:
+            run_stats["cache"] = self.response_cache.get_stats()
+        if self.delta_dirpath:
+            run_stats["delta"] = self.delta_stats
+        return run_stats
+
+    def get_taxon_path(self, dirpath, suffix):
+        """ File path for a data file, with the taxon name as part of the
+            file name. Example: redlist_chiroptera_info.txt """
+        return pathlib.Path(dirpath, "redlist_" + self.taxon_name + suffix)
+
+    def load_delta_base(self, dirpath):
+        """ Read species info saved by save_all, used as base for delta sync.
+            Returns a dict with taxonid as string: species_dict. Returns an
+            empty dict if there are no saved files. """
+        checklist_file = self.get_taxon_path(dirpath, "_checklist.txt")
+        info_file = self.get_taxon_path(dirpath, "_info.txt")
+        if not (checklist_file.exists() and info_file.exists()):
+            return {}
+        # The files are read by the load_* methods of another object, so
+        # that the data in this object is not replaced.
+        saved = IucnRedlist(taxon_name=self.taxon_name)
+        saved.load_checklist(dirpath)
+        saved.load_info(dirpath)
+        # Only species in the saved checklist are used.
+        checklist_taxonids = set(
+            str(taxonid) for taxonid in saved.chiroptera_checklist.values()
+        )
+        delta_base = {}
+        for species_dict in saved.chiroptera_info_dict.values():
+            taxonid = species_dict.get("taxonid", "")
+            if taxonid in checklist_taxonids:
+                delta_base[taxonid] = species_dict
+        return delta_base
+
+    def load_delta_by_country(self, dirpath):
+        """ Read species by country rows saved by save_all, used as base for
+            delta sync. Returns a dict with taxonid as string: list of rows.
+            Returns an empty dict if there is no saved file. """
+        by_country_file = self.get_taxon_path(dirpath, "_by_countries.txt")
+        if not by_country_file.exists():
+            return {}
+        saved = IucnRedlist(taxon_name=self.taxon_name)
+        saved.load_by_country(dirpath)
+        delta_by_country = {}
+        for row in saved.chiroptera_by_country_list:
+            delta_by_country.setdefault(row[1], []).append(tuple(row))
+        return delta_by_country
+
+    @redlist_metrics.timed_phase("save_all")
+    def save_all(self, dirpath="data", storage="tsv"):
+        """ Save all data to text files, storage="tsv", or to one SQLite
+            file, storage="sqlite". """
+        self.load_pending()
+        self.check_info_columns(self.chiroptera_info_header, "save_all")
         #
         if not pathlib.Path(dirpath).exists():
             pathlib.Path(dirpath).mkdir()
         #
-        version_file = pathlib.Path(dirpath, "redlist_version.txt")
-        with version_file.open("w") as file:
-            file.write(self.version)
+        if storage == "sqlite":
+            import redlist_sqlite
+
+            sqlite_file = self.get_taxon_path(dirpath, ".sqlite")
+            redlist_sqlite.SqliteStore(sqlite_file).save(self)
+            return
         #
-        checklist_file = pathlib.Path(dirpath, "redlist_chiroptera_checklist.txt")
-        with checklist_file.open("w") as file:
+        # Files are written to temp files and renamed when all are written.
+        # The version file is renamed last. A changed version file means that
+        # all files are published, see redlist_service.
+        renames = []
+        checklist_file = self.get_taxon_path(dirpath, "_checklist.txt")
+        with self.open_tmp_file(checklist_file, renames) as file:
             file.write("\t".join(self.chiroptera_checklist_header) + "\r\n")
-            for species_dict in self.chiroptera_dict.values():
-                file.write(
-                    species_dict["scientific_name"]
-                    + "\t"
-                    + str(species_dict["taxonid"])
-                    + "\r\n"
-                )
+            for scientific_name, taxonid in self.chiroptera_checklist.items():
+                file.write(scientific_name + "\t" + str(taxonid) + "\r\n")
         #
-        info_file = pathlib.Path(dirpath, "redlist_chiroptera_info.txt")
-        with info_file.open("w") as file:
+        info_file = self.get_taxon_path(dirpath, "_info.txt")
+        with self.open_tmp_file(info_file, renames) as file:
             file.write("\t".join(self.chiroptera_info_header) + "\r\n")
             for key in sorted(self.chiroptera_info_dict.keys()):
                 species_dict = self.chiroptera_info_dict[key]
                 row = []
                 for item in self.chiroptera_info_header:
-                    value = str(species_dict.get(item, ""))
-                    if value == "None":
-                        value = ""
-                    row.append(value)
+                    row.append(redlist_records.text_value(species_dict.get(item, "")))
                 file.write("\t".join(row) + "\r\n")
         #
         country_file = pathlib.Path(dirpath, "redlist_countries.txt")
-        with country_file.open("w") as file:
+        with self.open_tmp_file(country_file, renames) as file:
             file.write("\t".join(self.country_header) + "\r\n")
             for key in sorted(self.country_dict.keys()):
                 file.write(key + "\t" + self.country_dict[key] + "\r\n")
         #
-        country_file = pathlib.Path(dirpath, "redlist_chiroptera_by_countries.txt")
-        with country_file.open("w") as file:
+        country_file = self.get_taxon_path(dirpath, "_by_countries.txt")
+        with self.open_tmp_file(country_file, renames) as file:
             file.write("\t".join(self.chiroptera_by_country_header) + "\r\n")
             for fields in self.chiroptera_by_country_list:
                 file.write("\t".join(fields) + "\r\n")
+        #
+        version_file = pathlib.Path(dirpath, "redlist_version.txt")
+        with self.open_tmp_file(version_file, renames) as file:
+            file.write(self.version)
+        #
+        for tmp_path, filepath in renames:
+            os.replace(tmp_path, filepath)
+
+    def open_tmp_file(self, filepath, renames):
+        """ Open a temp file for writing, and add (temp path, file path) to
+            renames. """
+        tmp_path = filepath.with_name(filepath.name + ".tmp")
+        renames.append((tmp_path, filepath))
+        return tmp_path.open("w")
+
+    @redlist_metrics.timed_phase("load_all")
+    def load_all(
+        self, dirpath="data", storage="tsv", lazy=False, columns=None, compact=False
+    ):
+        """ Load data saved by save_all. For storage="sqlite" species info and
+            species by country rows are read from the SQLite file on demand,
+            and queries are made in SQLite.
+            If lazy=True each text file is read first time it is used, through
+            the get_* methods. If columns is given, only those species info
+            columns are kept. The index is then not built, and save_all,
+            create_excel and queries needing other columns raise ValueError.
+            If compact=True species info is stored as read-only SpeciesRecord
+            objects instead of dicts, with the same text values but using
+            less memory. """
+        self.lazy_loaders = {}
+        self.index = None
+        if storage == "sqlite":
+            self.load_sqlite(dirpath)
+            return
+        #
+        self.lazy_loaders = {
+            "version": lambda: self.load_version(dirpath),
+            "checklist": lambda: self.load_checklist(dirpath),
+            "info": lambda: self.load_info(dirpath, columns, compact),
+            "countries": lambda: self.load_countries(dirpath),
+            "by_country": lambda: self.load_by_country(dirpath),
+        }
+        if not lazy:
+            self.load_pending()
+            if columns is None:
+                self.build_index()
 
-    def load_all(self, dirpath="data"):
+    def load_version(self, dirpath="data"):
         """ """
-        # Version.
         version_file = pathlib.Path(dirpath, "redlist_version.txt")
         with version_file.open("r") as file:
             self.version = file.read()
 
-        # Checklist for Chiroptera. Taxonid and scientific_name.
+    def load_checklist(self, dirpath="data"):
+        """ Checklist for Chiroptera. Taxonid and scientific_name. """
         self.chiroptera_checklist = {}
-        checklist_file = pathlib.Path(dirpath, "redlist_chiroptera_checklist.txt")
+        checklist_file = self.get_taxon_path(dirpath, "_checklist.txt")
         with checklist_file.open("r") as file:
             for index, row in enumerate(file):
                 if index > 0:
@@ -197,204 +579,563 @@ class IucnRedlist(object):
                     if len(parts) > 1:
                         self.chiroptera_checklist[parts[0]] = int(parts[1])  # taxonid
 
-        # Chiroptera info.
-        self.chiroptera_checklist = {}
-        info_file = pathlib.Path(dirpath, "redlist_chiroptera_info.txt")
+    def load_info(self, dirpath="data", columns=None, compact=False):
+        """ Chiroptera info. Only the given columns are kept if columns
+            is not None. Compact records are used if compact=True. """
+        self.chiroptera_info_dict = {}
+        info_file = self.get_taxon_path(dirpath, "_info.txt")
         with info_file.open("r") as file:
             for index, row in enumerate(file):
                 if index == 0:
                     header = row.strip().split("\t")
+                    column_indexes = list(range(len(header)))
+                    if columns is not None:
+                        column_indexes = [
+                            header.index(item) for item in columns if item in header
+                        ]
+                    used_header = [header[index] for index in column_indexes]
+                    self.info_columns = used_header if columns is not None else None
+                    record_builder = redlist_records.RecordBuilder(used_header)
                 else:
                     parts = row.strip().split("\t")
-                    species_dict = dict(zip(header, parts))
                     if len(parts) > 1:
-                        self.chiroptera_info_dict[parts[0]] = species_dict
+                        scientific_name = parts[0]
+                        if columns is not None:
+                            parts += [""] * (len(header) - len(parts))
+                            parts = [parts[position] for position in column_indexes]
+                        if compact:
+                            species_dict = record_builder.create(parts)
+                        else:
+                            species_dict = dict(zip(used_header, parts))
+                        self.chiroptera_info_dict[scientific_name] = species_dict
 
-        # Available countries.
+    def load_countries(self, dirpath="data"):
+        """ Available countries. """
         self.country_dict = {}
-        version_file = pathlib.Path(dirpath, "redlist_countries.txt")
-        with version_file.open("r") as file:
+        country_file = pathlib.Path(dirpath, "redlist_countries.txt")
+        with country_file.open("r") as file:
             for index, row in enumerate(file):
                 if index > 0:
                     parts = row.strip().split("\t")
                     if len(parts) > 1:
                         self.country_dict[parts[0]] = parts[1]
 
-        # Countries and species match list.
+    def load_by_country(self, dirpath="data"):
+        """ Countries and species match list. """
         self.chiroptera_by_country_list = []
-        version_file = pathlib.Path(dirpath, "redlist_chiroptera_by_countries.txt")
-        with version_file.open("r") as file:
+        by_country_file = self.get_taxon_path(dirpath, "_by_countries.txt")
+        with by_country_file.open("r") as file:
             for index, row in enumerate(file):
                 if index > 0:
                     parts = row.strip().split("\t")
                     if len(parts) > 1:
                         self.chiroptera_by_country_list.append(parts)
 
+    def load_sqlite(self, dirpath="data"):
+        """ """
+        import redlist_sqlite
+
+        sqlite_file = self.get_taxon_path(dirpath, ".sqlite")
+        store = redlist_sqlite.SqliteStore(sqlite_file)
+        self.version = store.get_version()
+        self.chiroptera_checklist = store.get_checklist()
+        self.country_dict = store.get_country_dict()
+        self.chiroptera_info_dict = store.get_info_mapping()
+        self.info_columns = None
+        self.chiroptera_by_country_list = store.get_by_country_rows()
+        # The store has the same lookup methods as the index.
+        self.index = store
+
+    @redlist_metrics.timed_phase("version")
     def rest_get_version(self):
         """ Get IUCN version. """
         if not self.api_token:
             return
         #
-        url = "https://apiv3.iucnredlist.org/api/v3/version" + "?token=" + self.api_token
-        with urllib.request.urlopen(url) as response:
-            response_binary = response.read()
-            if response_binary:
-                response_json = json.loads(response_binary.decode("utf-8"))
-                self.version = response_json.get("version", "")
+        # https://apiv3.iucnredlist.org/api/v3/version?token=<YOUR TOKEN>
+        response_json = self.get_json("/version")
+        if response_json:
+            self.version = response_json.get("version", "")
         #
-        if self.debug:
-            print("DEBUG: version: " + str(self.version))
+        if self.metrics:
+            self.metrics.emit("version", version=self.version)
 
     def rest_get_chiroptera_species(self):
-        """ Get IUCN species list and store species where order = Chiroptera. """
+        """ Get IUCN species list and store species matching the taxon filter. """
         if not self.api_token:
             return
         #
-        # https://apiv3.iucnredlist.org/api/v3/species/page/<page_number>?token=<YOUR TOKEN>
-        page_number = 0
-        #         while (page_number is not None) and (page_number < 20):
-        self.chiroptera = {}
-        self.chiroptera_checklist = {}
-        while (page_number is not None) and (page_number < 100):
-            url = (
-                "https://apiv3.iucnredlist.org/api/v3/species/page/"
-                + str(page_number)
-                + "?token="
-                + self.api_token
+        self.rest_get_taxa_species([self])
+
+    @redlist_metrics.timed_phase("species")
+    def rest_get_taxa_species(self, redlists):
+        """ Scan the IUCN species list once, and store species matching the
+            taxon filter for each object in redlists. This object is used for
+            the requests. """
+        scanning = []
+        for redlist in redlists:
+            redlist.chiroptera = {}
+            redlist.chiroptera_checklist = {}
+            # Pages completed by an interrupted run. Pages are completed in order.
+            completed = redlist.checkpoint_get_completed("species_page")
+            for page_number in range(len(completed)):
+                redlist.add_chiroptera_page(page_number, completed[str(page_number)])
+            if not redlist.checkpoint_get_completed("species_done"):
+                scanning.append((redlist, len(completed)))
+        if not scanning:
+            return
+        # Pages are scanned until the first empty page, no upper limit. If
+        # the first empty page is known from the response cache, pages after
+        # it are not requested by the read-ahead.
+        scanning_redlists = [redlist for redlist, _ in scanning]
+        first_page = min(first_page for _, first_page in scanning)
+        end_page = self.get_cached_species_page_end()
+        empty_page = first_page
+        for page_number, rows_by_redlist in self.scan_pages(
+            lambda page_number: self.rest_get_taxa_page(page_number, scanning_redlists),
+            first_page=first_page,
+            end_page=end_page,
+        ):
+            empty_page = page_number + 1
+            for (redlist, redlist_first_page), rows in zip(scanning, rows_by_redlist):
+                if page_number >= redlist_first_page:
+                    redlist.checkpoint_record("species_page", page_number, rows)
+                    redlist.add_chiroptera_page(page_number, rows)
+        if self.response_cache and (end_page is None):
+            self.response_cache.put(
+                self.version, SPECIES_PAGE_END_PATH, str(empty_page).encode("utf-8")
             )
-            with urllib.request.urlopen(url) as response:
-                response_binary = response.read()
-                if not response_binary:
-                    page_number = None
-                else:
-                    response_json = json.loads(response_binary.decode("utf-8"))
-                    if response_json.get("count", 0) == 0:
-                        page_number = None
-                    else:
-                        for row_dict in response_json.get("result", []):
-                            if row_dict["order_name"] == "CHIROPTERA":
-                                self.chiroptera_count += 1
-                                self.chiroptera_dict[
-                                    row_dict["scientific_name"]
-                                ] = row_dict
-                                self.chiroptera_checklist[
-                                    row_dict["scientific_name"]
-                                ] = int(row_dict["taxonid"])
+        for redlist in scanning_redlists:
+            redlist.checkpoint_record("species_done", "", True)
             #
-            if self.debug:
-                print(
-                    "DEBUG: Page: "
-                    + str(page_number)
-                    + "   Chiroptera acc. counter: "
-                    + str(self.chiroptera_count)
+            if redlist.metrics:
+                redlist.metrics.emit(
+                    "species_total",
+                    taxon_name=redlist.taxon_name,
+                    count=redlist.chiroptera_count,
                 )
-            #
-            if page_number is not None:
-                page_number += 1
-                # page_number = None # For test.
+
+    def get_cached_species_page_end(self):
+        """ Number of the first empty species list page for the version, from
+            the response cache. None if not known. """
+        if not self.response_cache:
+            return None
+        response_binary = self.response_cache.get(self.version, SPECIES_PAGE_END_PATH)
+        if response_binary is None:
+            return None
+        return int(response_binary)
+
+    def add_chiroptera_page(self, page_number, rows):
+        """ """
+        for row_dict in rows:
+            self.chiroptera_count += 1
+            self.chiroptera_dict[row_dict["scientific_name"]] = row_dict
+            self.chiroptera_checklist[row_dict["scientific_name"]] = int(
+                row_dict["taxonid"]
+            )
         #
-        if self.debug:
-            print("DEBUG: Chiroptera total count: " + str(self.chiroptera_count))
+        if self.metrics:
+            self.metrics.emit(
+                "species_page",
+                taxon_name=self.taxon_name,
+                page_number=page_number,
+                count=self.chiroptera_count,
+            )
+
+    def rest_get_taxa_page(self, page_number, redlists):
+        """ Get one page from the IUCN species list and return a list with
+            the matching rows for each object in redlists. Returns None when
+            the page is empty. Called from worker threads. """
+        # https://apiv3.iucnredlist.org/api/v3/species/page/<page_number>?token=<YOUR TOKEN>
+        response_json = self.get_json("/species/page/" + str(page_number))
+        if response_json.get("count", 0) == 0:
+            return None
+        # Filter directly when the page arrives. Only the matching rows are
+        # kept, the rest of the page is released here.
+        rows_by_redlist = [[] for _ in redlists]
+        for row_dict in response_json.get("result", []):
+            for rows, redlist in zip(rows_by_redlist, redlists):
+                if redlist.match_taxon(row_dict):
+                    rows.append(row_dict)
+        return rows_by_redlist
+
+    def match_taxon(self, row_dict):
+        """ True if a row in the IUCN species list matches the taxon filter. """
+        for rank, names in self.taxon_filter.items():
+            if row_dict.get(rank + "_name", "").upper() in names:
+                return True
+        return False
 
+    @redlist_metrics.timed_phase("info")
     def rest_get_chiroptera_info(self):
-        """ Iterate over countries and store Chiroptera species for each country. """
+        """ Get species info for all Chiroptera species in the checklist.
+            Unchanged species in the delta sync base are not requested. """
         if not self.api_token:
             return
         #
-        for taxonid in list(self.chiroptera_checklist.values()):
-            # https://apiv3.iucnredlist.org/api/v3/species/id/:id?token='YOUR TOKEN'
-            url = (
-                "https://apiv3.iucnredlist.org/api/v3/species/id/"
-                + str(taxonid)
-                + "?token="
-                + self.api_token
-            )
-            with urllib.request.urlopen(url) as response:
-                response_binary = response.read()
-                if response_binary:
-                    response_json = json.loads(response_binary.decode("utf-8"))
-                    for row_dict in response_json.get("result", []):
-                        scientific_name = row_dict["scientific_name"]
-                        self.chiroptera_info_dict[scientific_name] = row_dict
-                        #
-                        if self.debug:
-                            print("DEBUG: Get info: " + scientific_name)
+        taxonids = list(self.chiroptera_checklist.values())
+        unchanged = self.get_unchanged_species()
+        results = self.map_checkpointed(
+            "species_info", self.rest_get_species_info, taxonids, known=unchanged
+        )
+        for taxonid, result_list in results:
+            for row_dict in result_list:
+                scientific_name = row_dict["scientific_name"]
+                self.chiroptera_info_dict[scientific_name] = row_dict
+                #
+                if self.metrics:
+                    self.metrics.emit(
+                        "species_info", scientific_name=scientific_name
+                    )
+
+    def get_unchanged_species(self):
+        """ Compare the species list with the delta sync base. Returns a dict
+            with taxonid as string: [species_dict] for unchanged species. """
+        unchanged = {}
+        added = 0
+        changed = 0
+        taxonids = set()
+        for row_dict in self.chiroptera_dict.values():
+            taxonid = str(row_dict["taxonid"])
+            taxonids.add(taxonid)
+            base_dict = self.delta_base.get(taxonid)
+            if base_dict is None:
+                added += 1
+                continue
+            for page_item, info_item in self.delta_summary_fields.items():
+                if page_item not in row_dict:
+                    continue
+                value = redlist_records.text_value(row_dict[page_item])
+                if value != base_dict.get(info_item, ""):
+                    changed += 1
+                    break
+            else:
+                unchanged[taxonid] = [base_dict]
+        #
+        self.delta_stats = {
+            "added": added,
+            "changed": changed,
+            "removed": len(set(self.delta_base) - taxonids),
+            "unchanged": len(unchanged),
+            "requests_avoided": len(unchanged),
+        }
+        return unchanged
 
+    def rest_get_species_info(self, taxonid):
+        """ Get species info for one taxonid. Called from worker threads. """
+        # https://apiv3.iucnredlist.org/api/v3/species/id/:id?token='YOUR TOKEN'
+        response_json = self.get_json("/species/id/" + str(taxonid))
+        return response_json.get("result", [])
+
+    @redlist_metrics.timed_phase("countries")
     def rest_get_countries(self):
         """ Get IUCN list of countries. """
         if not self.api_token:
             return
         #
         # https://apiv3.iucnredlist.org/api/v3/country/list?token=<YOUR TOKEN>
-        url = (
-            "https://apiv3.iucnredlist.org/api/v3/country/list"
-            + "?token="
-            + self.api_token
-        )
-        with urllib.request.urlopen(url) as response:
-            response_binary = response.read()
-            if response_binary:
-                response_json = json.loads(response_binary.decode("utf-8"))
-                if response_json.get("count", 0) > 0:
-                    for row_dict in response_json.get("results", []):
-                        self.country_count += 1
-                        self.country_dict[row_dict["isocode"]] = row_dict["country"]
+        response_json = self.get_json("/country/list")
+        if response_json.get("count", 0) > 0:
+            for row_dict in response_json.get("results", []):
+                self.country_count += 1
+                self.country_dict[row_dict["isocode"]] = row_dict["country"]
 
+    @redlist_metrics.timed_phase("by_country")
     def rest_get_chiroptera_by_country(self):
-        """ Iterate over countries and store Chiroptera species for each country. """
+        """ Store Chiroptera species for each country. Requests are made per
+            country or per species, as selected by the planner. All strategies
+            give the same result. """
         if not self.api_token:
             return
         #
         checklist_taxonids = list(self.chiroptera_checklist.values())
-
-        for country_isocode in self.country_dict.keys():
-            #         for country_isocode in ['SE']: # For test.
-            if self.debug:
-                print("DEBUG: Taxa in country: " + country_isocode)
-
-            # https://apiv3.iucnredlist.org/api/v3/country/getspecies/<country>?token=<YOUR TOKEN>
-            url = (
-                "https://apiv3.iucnredlist.org/api/v3/country/getspecies/"
-                + country_isocode.lower()
-                + "?token="
-                + self.api_token
+        country_isocodes = list(self.country_dict.keys())
+        #         country_isocodes = ['SE'] # For test.
+        # Saved rows from a delta sync base are only used for the estimate.
+        if self.delta_by_country:
+            self.planner.update_from_rows(
+                sum(len(rows) for rows in self.delta_by_country.values()),
+                len(self.delta_by_country),
+            )
+        #
+        if self.by_country_strategy == "auto":
+            estimate = self.planner.plan(len(country_isocodes), len(checklist_taxonids))
+        else:
+            estimate = self.planner.estimate(
+                self.by_country_strategy,
+                len(country_isocodes),
+                len(checklist_taxonids),
             )
-            with urllib.request.urlopen(url) as response:
-                response_binary = response.read()
-                if response_binary:
-                    response_json = json.loads(response_binary.decode("utf-8"))
-                    for row_dict in response_json.get("result", []):
-                        taxonid = row_dict["taxonid"]
-                        if taxonid in checklist_taxonids:
-                            self.chiroptera_by_country_count += 1
-                            self.chiroptera_by_country_list.append(
-                                (
-                                    country_isocode,
-                                    str(taxonid),
-                                    row_dict["scientific_name"],
-                                    row_dict["category"],
-                                )
-                            )
-
-    def create_excel(self, dirpath="."):
-        """ Export to Excel. """
-        #
-        excel_filepathname = pathlib.Path(
-            dirpath, "redlist_chiroptera_" + self.get_redlist_version() + ".xlsx"
+        strategy = estimate["strategy"]
+        #
+        stats_before = self.http_client.get_stats()
+        rows_by_country = {}
+        if strategy == "country":
+            self.get_by_country_from_countries(
+                country_isocodes, set(checklist_taxonids), rows_by_country
+            )
+        elif strategy == "species":
+            self.get_by_country_from_species(checklist_taxonids, rows_by_country)
+        stats_after = self.http_client.get_stats()
+        # Same order for all strategies: countries in the order of the
+        # country list, taxa in checklist order.
+        taxon_order = {}
+        for index, taxonid in enumerate(checklist_taxonids):
+            taxon_order[str(taxonid)] = index
+        for country_isocode in country_isocodes:
+            rows = rows_by_country.get(country_isocode, {})
+            for taxonid in sorted(rows, key=lambda taxonid: taxon_order[taxonid]):
+                self.chiroptera_by_country_count += 1
+                self.chiroptera_by_country_list.append(rows[taxonid])
+        #
+        self.plan_stats = {
+            "strategy": strategy,
+            "estimated_requests": estimate["requests"],
+            "estimated_bytes": estimate["bytes"],
+            "actual_requests": stats_after["requests"] - stats_before["requests"],
+            "actual_bytes": (
+                stats_after["bytes_decoded"] - stats_before["bytes_decoded"]
+            ),
+        }
+        if self.metrics:
+            self.metrics.emit("by_country_plan", **self.plan_stats)
+
+    def get_by_country_from_countries(
+        self, country_isocodes, checklist_taxonids, rows_by_country
+    ):
+        """ One request per country. Rows are added to rows_by_country. """
+        results = self.map_checkpointed(
+            "country_species",
+            lambda country_isocode: self.rest_get_species_by_country(
+                country_isocode, checklist_taxonids
+            ),
+            country_isocodes,
+        )
+        for country_isocode, rows in results:
+            if self.metrics:
+                self.metrics.emit("country_species", country=country_isocode)
+            #
+            for row in rows:
+                rows_by_country.setdefault(country_isocode, {})[row[1]] = tuple(row)
+
+    def get_by_country_from_species(self, taxonids, rows_by_country):
+        """ One request per taxon. Rows are added to rows_by_country. """
+        species_by_taxonid = {}
+        for row_dict in self.chiroptera_dict.values():
+            species_by_taxonid[str(row_dict["taxonid"])] = row_dict
+        #
+        results = self.map_checkpointed(
+            "species_countries", self.rest_get_species_countries, taxonids
+        )
+        for taxonid, country_isocodes in results:
+            row_dict = species_by_taxonid[str(taxonid)]
+            if self.metrics:
+                self.metrics.emit(
+                    "species_countries", scientific_name=row_dict["scientific_name"]
+                )
+            #
+            for country_isocode in country_isocodes:
+                rows_by_country.setdefault(country_isocode, {})[str(taxonid)] = (
+                    country_isocode,
+                    str(taxonid),
+                    row_dict["scientific_name"],
+                    row_dict["category"],
+                )
+
+    def rest_get_species_countries(self, taxonid):
+        """ Get country isocodes for one taxonid. Called from worker threads. """
+        # https://apiv3.iucnredlist.org/api/v3/species/countries/id/:id?token='YOUR TOKEN'
+        response_json = self.get_json("/species/countries/id/" + str(taxonid))
+        return [row_dict["code"] for row_dict in response_json.get("result", [])]
+
+    def rest_get_species_by_country(self, country_isocode, checklist_taxonids):
+        """ Get species for one country, filtered by taxonids.
+            Called from worker threads. """
+        rows = []
+        # https://apiv3.iucnredlist.org/api/v3/country/getspecies/<country>?token=<YOUR TOKEN>
+        response_json = self.get_json(
+            "/country/getspecies/" + country_isocode.lower()
+        )
+        for row_dict in response_json.get("result", []):
+            taxonid = row_dict["taxonid"]
+            if taxonid in checklist_taxonids:
+                rows.append(
+                    (
+                        country_isocode,
+                        str(taxonid),
+                        row_dict["scientific_name"],
+                        row_dict["category"],
+                    )
+                )
+        return rows
+
+    def get_json(self, path):
+        """ Get and decode one JSON response from the API, or from the
+            response cache if used. Returns {} for empty responses. """
+        params = {"token": self.api_token}
+        if not self.response_cache:
+            return self.http_client.get_json(path, params=params)
+        #
+        if path == "/version":
+            # The version is the key for everything else, and is
+            # cached for a shorter time.
+            version, ttl = "", self.version_ttl
+        else:
+            version, ttl = self.version, None
+        response_binary = self.response_cache.get(version, path, ttl=ttl)
+        if response_binary is None:
+            response_binary = self.http_client.get(path, params=params)
+            self.response_cache.put(version, path, response_binary)
+        elif self.metrics:
+            self.metrics.record_cache_hit(path)
+        return self.http_client.decode_json(path, response_binary)
+
+    def get_http_stats(self):
+        """ Request and connection counters for the last get_all_from_api run. """
+        if self.http_client is None:
+            return {}
+        return self.http_client.get_stats()
+
+    def map_concurrent(self, function, items):
+        """ Call function for each item with max_workers requests in flight.
+            Results are yielded in the same order as items, which makes the
+            merged result identical to a sequential run. """
+        if self.max_workers <= 1:
+            for item in items:
+                yield function(item)
+            return
+        #
+        import concurrent.futures
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            for result in executor.map(function, items):
+                yield result
+        finally:
+            # Don't start queued requests if one of them failed.
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def map_checkpointed(self, phase, function, items, known=None):
+        """ Like map_concurrent, but yields (item, result) and skips items
+            already completed according to the checkpoint journal. Completed
+            results are recorded in the journal as they are returned.
+            Results in known, with str(item) as key, are used as they are. """
+        completed = dict(known or {})
+        completed.update(self.checkpoint_get_completed(phase))
+        remaining_items = [item for item in items if str(item) not in completed]
+        results = self.map_concurrent(function, remaining_items)
+        try:
+            for item in items:
+                if str(item) in completed:
+                    yield item, completed[str(item)]
+                else:
+                    result = next(results)
+                    self.checkpoint_record(phase, item, result)
+                    yield item, result
+        finally:
+            results.close()
+
+    def checkpoint_get_completed(self, phase):
+        """ """
+        if not self.checkpoint:
+            return {}
+        return self.checkpoint.get_completed(phase)
+
+    def checkpoint_record(self, phase, key, data):
+        """ """
+        if self.checkpoint:
+            self.checkpoint.record(phase, key, data)
+
+    def scan_pages(self, function, first_page=0, end_page=None):
+        """ Call function for page numbers first_page, first_page + 1, ...
+            and yield (page_number, result) in page order until function
+            returns None, or until end_page if given. Up to max_workers pages
+            are fetched ahead, but not end_page and later pages. """
+        page_number = first_page
+        if self.max_workers <= 1:
+            while (end_page is None) or (page_number < end_page):
+                result = function(page_number)
+                if result is None:
+                    return
+                yield page_number, result
+                page_number += 1
+            return
+        #
+        import concurrent.futures
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        pending = collections.deque()
+        try:
+            while True:
+                # Keep the window of speculative requests full.
+                while (len(pending) < self.max_workers) and (
+                    (end_page is None) or (page_number < end_page)
+                ):
+                    future = executor.submit(function, page_number)
+                    pending.append((page_number, future))
+                    page_number += 1
+                if not pending:
+                    return
+                #
+                current_page, future = pending.popleft()
+                result = future.result()
+                if result is None:
+                    # Last page reached. Pages after this one are skipped.
+                    return
+                yield current_page, result
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    @redlist_metrics.timed_phase("create_excel")
+    def create_excel(self, dirpath=".", changes=None, statistics=True):
+        """ Export to Excel. Rows from get_changes are added as an extra
+            sheet if changes is given. Sheets with species counts per country,
+            family and category are added if statistics=True. """
+        import xlsxwriter
+
+        self.load_pending()
+        self.check_info_columns(self.chiroptera_info_header, "create_excel")
+        #
+        excel_filepathname = self.get_taxon_path(
+            dirpath, "_" + self.get_redlist_version() + ".xlsx"
+        )
+        # Create Excel document. Rows are written to temp files one at a time
+        # in constant memory mode, and must be written in row order.
+        workbook = xlsxwriter.Workbook(
+            str(excel_filepathname), {"constant_memory": True}
         )
-        # Create Excel document.
-        workbook = xlsxwriter.Workbook(str(excel_filepathname))
 
         # Add worksheets.
-        summary_worksheet = workbook.add_worksheet("Chiroptera summary")
-        info_worksheet = workbook.add_worksheet("Chiroptera info")
+        sheet_prefix = self.taxon_name.capitalize()
+        summary_worksheet = workbook.add_worksheet(sheet_prefix + " summary")
+        info_worksheet = workbook.add_worksheet(sheet_prefix + " info")
         countries_worksheet = workbook.add_worksheet("Countries")
-        species_by_country_worksheet = workbook.add_worksheet("Chiroptera by country")
+        species_by_country_worksheet = workbook.add_worksheet(
+            sheet_prefix + " by country"
+        )
+        statistics_worksheets = []
+        if statistics:
+            for matrix_name in [
+                "country_by_category",
+                "family_by_category",
+                "country_by_family",
+            ]:
+                sheet_name = matrix_name.replace("_", " ").capitalize()
+                statistics_worksheets.append(
+                    (matrix_name, workbook.add_worksheet(sheet_name))
+                )
+        changes_worksheet = None
+        if changes is not None:
+            changes_worksheet = workbook.add_worksheet("Changes")
         citation_worksheet = workbook.add_worksheet("Citation")
         about_worksheet = workbook.add_worksheet("About")
 
         # Create cell formats.
         self.bold_format = workbook.add_format({"bold": True})
+        #
+        index = self.get_index()
+        # Same order for all species sheets.
+        species_keys = sorted(self.chiroptera_info_dict.keys())
 
         # === Sheet: Chiroptera summary. ===
         # Header.
@@ -403,7 +1144,7 @@ class IucnRedlist(object):
         )
         # Rows.
         row_nr = 1
-        for key in sorted(self.chiroptera_info_dict.keys()):
+        for key in species_keys:
             species_dict = self.chiroptera_info_dict[key]
             row = []
             for item in self.chiroptera_summary_header:
@@ -413,12 +1154,8 @@ class IucnRedlist(object):
                 elif item == "family":
                     value = value.capitalize()
                 elif item == "countries":
-                    countries = []
                     taxonid = species_dict.get("taxonid", "")
-                    for country_row in self.chiroptera_by_country_list:
-                        if country_row[1] == taxonid:
-                            countries.append(country_row[0])
-                    value = ", ".join(sorted(countries))
+                    value = ", ".join(index.get_countries(taxonid))
                 #
                 row.append(value)
             #
@@ -430,14 +1167,11 @@ class IucnRedlist(object):
         info_worksheet.write_row(0, 0, self.chiroptera_info_header, self.bold_format)
         # Rows.
         row_nr = 1
-        for key in sorted(self.chiroptera_info_dict.keys()):
+        for key in species_keys:
             species_dict = self.chiroptera_info_dict[key]
             row = []
             for item in self.chiroptera_info_header:
-                value = str(species_dict.get(item, ""))
-                if value == "None":
-                    value = ""
-                row.append(value)
+                row.append(self.excel_value(item, species_dict.get(item, "")))
             #
             info_worksheet.write_row(row_nr, 0, row)
             row_nr += 1
@@ -459,9 +1193,43 @@ class IucnRedlist(object):
         # Rows.
         row_nr = 1
         for row in sorted(self.chiroptera_by_country_list):
+            row = [
+                self.excel_value(item, value)
+                for item, value in zip(self.chiroptera_by_country_header, row)
+            ]
             species_by_country_worksheet.write_row(row_nr, 0, row)
             row_nr += 1
 
+        # === Sheets: Country by category, etc. ===
+        for matrix_name, statistics_worksheet in statistics_worksheets:
+            header, rows = self.get_statistics().get_table(matrix_name)
+            # Header.
+            statistics_worksheet.write_row(0, 0, header, self.bold_format)
+            # Rows.
+            row_nr = 1
+            for row in rows:
+                statistics_worksheet.write_row(row_nr, 0, row)
+                row_nr += 1
+            statistics_worksheet.set_column("A:A", 20)
+
+        # === Sheet: Changes. ===
+        if changes_worksheet is not None:
+            import redlist_archive
+
+            # Header.
+            changes_worksheet.write_row(
+                0, 0, redlist_archive.CHANGES_HEADER, self.bold_format
+            )
+            # Rows.
+            row_nr = 1
+            for row in changes:
+                row = [
+                    self.excel_value(item, value)
+                    for item, value in zip(redlist_archive.CHANGES_HEADER, row)
+                ]
+                changes_worksheet.write_row(row_nr, 0, row)
+                row_nr += 1
+
         # === Sheet: Citation. ===
         # Header.
         citation_worksheet.write_row(0, 0, ["IUCN Redlist citation"], self.bold_format)
@@ -521,32 +1289,135 @@ class IucnRedlist(object):
         species_by_country_worksheet.set_column("C:C", 40)
         species_by_country_worksheet.set_column("D:D", 20)
 
+        if changes_worksheet is not None:
+            changes_worksheet.set_column("A:B", 20)
+            changes_worksheet.set_column("C:E", 40)
         citation_worksheet.set_column("A:A", 100)
         about_worksheet.set_column("A:A", 100)
 
         # === Done. Close the Excel document. ===
         workbook.close()
 
+    def export_all(self, dirpath=".", formats=None, max_workers=None, changes=None):
+        """ Export to xlsx, csv, jsonl and columnar files, in parallel
+            processes. Rows from get_changes are added as a sheet in the xlsx
+            file if changes is given. See redlist_export. """
+        import redlist_export
 
-### Main. ###
-if __name__ == "__main__":
-    """ """
+        return redlist_export.export_all(
+            self,
+            dirpath=dirpath,
+            formats=formats,
+            max_workers=max_workers,
+            changes=changes,
+        )
+
+    def archive_snapshot(self, archive_dirpath):
+        """ Add the loaded data to the version archive. Records unchanged
+            since earlier versions are not stored again. See redlist_archive. """
+        import redlist_archive
 
-    token = "<TOKEN>"  # Replace with your token.
+        return redlist_archive.SnapshotArchive(archive_dirpath).add(self)
 
-    redlist = IucnRedlist(api_token=token, debug=True)
-    if len(token) > 10:
-        # Update from IUCN Red list. This will take some time
-        # since all taxa must be checked to find out if they
-        # belongs to Chiroptera.
-        redlist.get_all_from_api()
-        redlist.save_all(dirpath="taxa4bats/data")
+    def get_changes(self, archive_dirpath, old_version=None):
+        """ Changes from an archived version to the loaded data, as rows with
+            redlist_archive.CHANGES_HEADER columns. The latest archived version
+            before the loaded version is used if old_version is not given.
+            Returns an empty list if there is no earlier version. """
+        import redlist_archive
 
-    # Load from cache if token not given.
-    redlist.clear()
-    redlist.load_all(dirpath="taxa4bats/data")
+        archive = redlist_archive.SnapshotArchive(archive_dirpath)
+        if old_version is None:
+            old_versions = [
+                version
+                for version in archive.get_versions(self.taxon_name)
+                if version < self.get_redlist_version()
+            ]
+            if not old_versions:
+                return []
+            old_version = old_versions[-1]
+        return redlist_archive.diff_snapshots(
+            archive.get_snapshot(old_version, self.taxon_name),
+            redlist_archive.Snapshot.from_redlist(self),
+        )
+
+    def excel_value(self, item, value):
+        """ Numeric columns are returned as numbers, None for empty values,
+            and other columns as text. """
+        value = redlist_records.text_value(value)
+        if item in redlist_records.NUMERIC_COLUMNS:
+            return redlist_records.to_number(value)
+        return value
+
+
+def get_all_taxa_from_api(redlists, resume=False, delta_dirpaths=None):
+    """ Get all data from the API for one or more taxon groups, one IucnRedlist
+        object per group. The species list, with more than 100 000 taxa, is
+        scanned once for all groups, and version and countries are requested
+        once. These shared requests are made by the first object. Species info
+        and species by country are requested per group. delta_dirpaths is a
+        list with one delta_dirpath, or None, per group. """
+    delta_dirpaths = delta_dirpaths or [None] * len(redlists)
+    # Objects without token are not used. Delta dirpaths are filtered with them.
+    redlists_and_delta_dirpaths = [
+        (redlist, delta_dirpath)
+        for redlist, delta_dirpath in zip(redlists, delta_dirpaths)
+        if redlist.api_token
+    ]
+    if not redlists_and_delta_dirpaths:
+        return
+    redlists = [redlist for redlist, _ in redlists_and_delta_dirpaths]
+    first_redlist = redlists[0]
+    started = time.perf_counter()
+    #
+    for redlist, delta_dirpath in redlists_and_delta_dirpaths:
+        redlist.start_api_run(resume=resume, delta_dirpath=delta_dirpath)
+    try:
+        first_redlist.rest_get_version()
+        for redlist in redlists:
+            redlist.version = first_redlist.version
+            if redlist.checkpoint:
+                redlist.checkpoint.check_version(redlist.version)
+        #
+        first_redlist.rest_get_taxa_species(redlists)
+        #
+        for redlist in redlists:
+            redlist.rest_get_chiroptera_info()
+        #
+        first_redlist.rest_get_countries()
+        for redlist in redlists:
+            if redlist is not first_redlist:
+                redlist.country_count = first_redlist.country_count
+                redlist.country_dict = dict(first_redlist.country_dict)
+        #
+        for redlist in redlists:
+            redlist.rest_get_chiroptera_by_country()
+    finally:
+        for redlist in redlists:
+            redlist.stop_api_run()
+    for redlist in redlists:
+        redlist.finish_api_run()
+    # One report per metrics object. Objects may share metrics.
+    seconds = time.perf_counter() - started
+    metrics_list = []
+    for redlist in redlists:
+        if redlist.metrics and (redlist.metrics not in metrics_list):
+            metrics_list.append(redlist.metrics)
+    for metrics in metrics_list:
+        taxon_names = []
+        run_stats = {}
+        for redlist in redlists:
+            if redlist.metrics is metrics:
+                taxon_names.append(redlist.taxon_name)
+                run_stats[redlist.taxon_name] = redlist.get_run_stats()
+        metrics.add_phase("get_all_from_api", seconds, ",".join(taxon_names))
+        metrics.report(run_stats)
 
-    redlist.create_excel()
 
-    print("Done. ", redlist.get_redlist_citation())
+### Main. ###
+if __name__ == "__main__":
+    """ See redlist_cli for the commands. """
+    import sys
+    import redlist_cli
 
+    sys.exit(redlist_cli.main())
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import numpy
+
+# Red List categories in the order used for columns. Other categories
+# found in the data are added after these.
+CATEGORIES = ["EX", "EW", "CR", "EN", "VU", "NT", "LC", "DD", "NE"]
+
+# Name: (row dimension, column dimension).
+MATRICES = {
+    "country_by_category": ("country", "category"),
+    "family_by_category": ("family", "category"),
+    "country_by_family": ("country", "family"),
+}
+
+
+class ThreatStatistics(object):
+    """ Species counts per country, family and category.
+        Countries, categories and families are dictionary encoded as integer
+        codes, one array per column. The cross tables are counted with
+        numpy.bincount on combined codes, row_code * column_count + column_code,
+        instead of loops in Python. Each species is counted once per country,
+        also if there are duplicated species by country rows. """
+
+    def __init__(self, info_dict=None, by_country_list=None):
+        """ """
+        self.labels = {"country": [], "category": [], "family": []}
+        self.codes = {"country": {}, "category": {}, "family": {}}
+        for category in CATEGORIES:
+            self.encode("category", category)
+        #
+        self.build(info_dict or {}, by_country_list or [])
+
+    def build(self, info_dict, by_country_list):
+        """ One pass over each data set to encode, then only array operations. """
+        species_positions = {}
+        species_category = []
+        species_family = []
+        for species_dict in info_dict.values():
+            taxonid = str(species_dict.get("taxonid", ""))
+            species_positions[taxonid] = len(species_category)
+            species_category.append(
+                self.encode("category", str(species_dict.get("category", "")))
+            )
+            species_family.append(
+                self.encode("family", str(species_dict.get("family", "")).upper())
+            )
+        self.species_category = numpy.array(species_category, dtype=numpy.int64)
+        self.species_family = numpy.array(species_family, dtype=numpy.int64)
+        # Rows for species not in the species info are not used.
+        row_country = []
+        row_species = []
+        for row in by_country_list:
+            position = species_positions.get(str(row[1]))
+            if position is not None:
+                row_country.append(self.encode("country", row[0]))
+                row_species.append(position)
+        # Unique (country, species) pairs.
+        species_count = max(len(species_category), 1)
+        pairs = numpy.unique(
+            numpy.array(row_country, dtype=numpy.int64) * species_count
+            + numpy.array(row_species, dtype=numpy.int64)
+        )
+        self.pair_country = pairs // species_count
+        self.pair_species = pairs % species_count
+        #
+        self.matrices = {}
+
+    def encode(self, dimension, label):
+        """ Returns the integer code for a label. New labels get the next code. """
+        codes = self.codes[dimension]
+        code = codes.get(label)
+        if code is None:
+            code = len(codes)
+            codes[label] = code
+            self.labels[dimension].append(label)
+        return code
+
+    def get_matrix(self, name):
+        """ Returns a numpy array with counts, with one row per row label and
+            one column per column label. See get_labels. """
+        matrix = self.matrices.get(name)
+        if matrix is None:
+            matrix = self.calculate_matrix(name)
+            self.matrices[name] = matrix
+        return matrix
+
+    def calculate_matrix(self, name):
+        """ """
+        if name not in MATRICES:
+            raise ValueError("Unknown matrix: " + str(name))
+        row_dimension, column_dimension = MATRICES[name]
+        per_country = row_dimension == "country"
+        row_codes = self.get_codes(row_dimension, per_country)
+        column_codes = self.get_codes(column_dimension, per_country)
+        row_count = len(self.labels[row_dimension])
+        column_count = len(self.labels[column_dimension])
+        counts = numpy.bincount(
+            row_codes * column_count + column_codes,
+            minlength=row_count * column_count,
+        )
+        return counts.reshape(row_count, column_count)
+
+    def get_codes(self, dimension, per_country):
+        """ Codes per species, or per (country, species) pair. """
+        if dimension == "country":
+            return self.pair_country
+        species_codes = {
+            "category": self.species_category,
+            "family": self.species_family,
+        }[dimension]
+        if per_country:
+            return species_codes[self.pair_species]
+        return species_codes
+
+    def get_labels(self, name):
+        """ Returns row labels and column labels for a matrix. """
+        row_dimension, column_dimension = MATRICES[name]
+        return list(self.labels[row_dimension]), list(self.labels[column_dimension])
+
+    def get_table(self, name):
+        """ Returns a header and rows for a matrix, sorted by row label, with
+            a total column. Empty rows and columns are not included. """
+        row_dimension, column_dimension = MATRICES[name]
+        matrix = self.get_matrix(name)
+        row_labels, column_labels = self.get_labels(name)
+        used_columns = numpy.flatnonzero(matrix.sum(axis=0))
+        if column_dimension == "category":
+            used_columns = [
+                column for column in used_columns if column_labels[column] != ""
+            ] + [column for column in used_columns if column_labels[column] == ""]
+        else:
+            used_columns = sorted(
+                used_columns, key=lambda column: column_labels[column]
+            )
+        header = [row_dimension] + [column_labels[column] for column in used_columns]
+        header.append("total")
+        rows = []
+        for row in sorted(
+            numpy.flatnonzero(matrix.sum(axis=1)), key=lambda row: row_labels[row]
+        ):
+            counts = [int(matrix[row, column]) for column in used_columns]
+            rows.append([row_labels[row]] + counts + [sum(counts)])
+        return header, rows
+
+    def count_species(self, country=None, category=None, family=None):
+        """ Number of species matching all given filters. """
+        mask = numpy.ones(len(self.species_category), dtype=bool)
+        if category is not None:
+            category_code = self.codes["category"].get(category, -1)
+            mask &= self.species_category == category_code
+        if family is not None:
+            family_code = self.codes["family"].get(family.upper(), -1)
+            mask &= self.species_family == family_code
+        if country is not None:
+            in_country = numpy.zeros(len(self.species_category), dtype=bool)
+            country_code = self.codes["country"].get(country, -1)
+            in_country[self.pair_species[self.pair_country == country_code]] = True
+            mask &= in_country
+        return int(numpy.count_nonzero(mask))
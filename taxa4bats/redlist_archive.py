@@ -0,0 +1,296 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import os
+import json
+import zlib
+import hashlib
+import pathlib
+import threading
+
+import redlist_records
+
+# Columns in the rows returned by diff_snapshots.
+CHANGES_HEADER = [
+    "change",
+    "taxonid",
+    "scientific_name",
+    "old_value",
+    "new_value",
+]
+
+
+class SnapshotArchive(object):
+    """ Archive with one snapshot per Red List version and taxon name.
+        Each taxon is stored as one record, with species info and species
+        by country rows, in a file named by the sha256 of the content.
+        Records that are unchanged between versions are stored once.
+        A small manifest file per version lists the records. """
+
+    def __init__(self, dirpath):
+        """ """
+        self.dirpath = pathlib.Path(dirpath)
+        self.versions_dirpath = pathlib.Path(self.dirpath, "versions")
+        self.records_dirpath = pathlib.Path(self.dirpath, "records")
+
+    def add(self, redlist):
+        """ Store the data in a loaded IucnRedlist as a snapshot for its
+            version. Returns a dict with records written and reused. """
+        snapshot = Snapshot.from_redlist(redlist)
+        stats = {"records_written": 0, "records_reused": 0}
+        for key, record in snapshot.records.items():
+            record_path = self.record_path(key)
+            if record_path.exists():
+                stats["records_reused"] += 1
+                continue
+            record_path.parent.mkdir(parents=True, exist_ok=True)
+            record_binary = json.dumps(record, separators=(",", ":")).encode("utf-8")
+            write_atomic(record_path, zlib.compress(record_binary))
+            stats["records_written"] += 1
+        # The manifest is written last. A snapshot is not listed until all
+        # records are stored.
+        self.versions_dirpath.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.manifest_path(snapshot.taxon_name, snapshot.version)
+        manifest_binary = json.dumps(snapshot.manifest, indent=1).encode("utf-8")
+        write_atomic(manifest_path, manifest_binary)
+        return stats
+
+    def get_versions(self, taxon_name="chiroptera"):
+        """ Returns archived versions for taxon_name, oldest first. """
+        if not self.versions_dirpath.exists():
+            return []
+        prefix = taxon_name + "_"
+        versions = []
+        for manifest_path in self.versions_dirpath.glob(prefix + "*.json"):
+            versions.append(manifest_path.name[len(prefix) : -len(".json")])
+        return sorted(versions)
+
+    def get_snapshot(self, version, taxon_name="chiroptera"):
+        """ Returns an archived Snapshot. Records are read when used. """
+        manifest_path = self.manifest_path(taxon_name, version)
+        if not manifest_path.exists():
+            raise ValueError("Version not in archive: " + str(version))
+        with manifest_path.open("r", encoding="utf-8") as file:
+            manifest = json.load(file)
+        return Snapshot(manifest, read_record=self.read_record)
+
+    def restore(self, version, redlist):
+        """ Load an archived version into an IucnRedlist object. The data is
+            the same as when the snapshot was added. """
+        self.get_snapshot(version, redlist.taxon_name).to_redlist(redlist)
+
+    def read_record(self, key):
+        """ """
+        with self.record_path(key).open("rb") as file:
+            return json.loads(zlib.decompress(file.read()).decode("utf-8"))
+
+    def record_path(self, key):
+        """ """
+        return pathlib.Path(self.records_dirpath, key[0:2], key + ".zlib")
+
+    def manifest_path(self, taxon_name, version):
+        """ """
+        return pathlib.Path(self.versions_dirpath, taxon_name + "_" + version + ".json")
+
+
+class Snapshot(object):
+    """ One version of the data. The manifest contains version, headers,
+        countries, checklist and one record key per taxonid. Records are
+        kept in memory for snapshots created from an IucnRedlist, and read
+        on demand for archived snapshots. """
+
+    def __init__(self, manifest, records=None, read_record=None):
+        """ """
+        self.manifest = manifest
+        self.version = manifest["version"]
+        self.taxon_name = manifest["taxon_name"]
+        # Taxonid as string: record key.
+        self.record_keys = dict(manifest["records"])
+        self.records = records or {}
+        self.read_record = read_record
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_redlist(cls, redlist):
+        """ """
+        redlist.check_info_columns(redlist.chiroptera_info_header, "the archive")
+        info_dict = redlist.get_chiroptera_info_dict()
+        by_country_list = redlist.get_chiroptera_by_country_list()
+        info_header = list(redlist.chiroptera_info_header)
+        #
+        record_contents = {}
+        for scientific_name in sorted(info_dict.keys()):
+            species_dict = info_dict[scientific_name]
+            taxonid = redlist_records.text_value(species_dict.get("taxonid", ""))
+            record_contents[taxonid] = {
+                "info": [
+                    redlist_records.text_value(species_dict.get(item, ""))
+                    for item in info_header
+                ],
+                "by_country": [],
+            }
+        # Taxonid per row, to restore the row order.
+        by_country_order = []
+        for row in by_country_list:
+            taxonid = redlist_records.text_value(row[1])
+            by_country_order.append(taxonid)
+            record_content = record_contents.setdefault(
+                taxonid, {"info": None, "by_country": []}
+            )
+            record_content["by_country"].append(
+                [redlist_records.text_value(value) for value in row]
+            )
+        #
+        records = {}
+        record_keys = []
+        for taxonid, record_content in record_contents.items():
+            key = make_record_key(record_content)
+            records[key] = record_content
+            record_keys.append([taxonid, key])
+        checklist = redlist.get_chiroptera_checklist()
+        manifest = {
+            "version": redlist.get_redlist_version(),
+            "taxon_name": redlist.taxon_name,
+            "info_header": info_header,
+            "countries": sorted(redlist.get_country_dict().items()),
+            "checklist": [
+                [scientific_name, redlist_records.text_value(taxonid)]
+                for scientific_name, taxonid in checklist.items()
+            ],
+            "records": record_keys,
+            "by_country_order": by_country_order,
+        }
+        return cls(manifest, records=records)
+
+    def get_record(self, taxonid):
+        """ Returns the record for one taxonid, or None. """
+        key = self.record_keys.get(str(taxonid))
+        if key is None:
+            return None
+        with self.lock:
+            record = self.records.get(key)
+            if record is None:
+                record = self.read_record(key)
+                self.records[key] = record
+        return record
+
+    def get_species_dict(self, taxonid):
+        """ Species info as a dict, or None. """
+        record = self.get_record(taxonid)
+        if (record is None) or (record["info"] is None):
+            return None
+        return dict(zip(self.manifest["info_header"], record["info"]))
+
+    def get_countries(self, taxonid):
+        """ Sorted country isocodes for one taxonid. """
+        record = self.get_record(taxonid)
+        if record is None:
+            return []
+        return sorted(row[0] for row in record["by_country"])
+
+    def to_redlist(self, redlist):
+        """ Set the data in an IucnRedlist object, in the same format as
+            after load_all with compact=False. """
+        redlist.clear()
+        redlist.version = self.version
+        redlist.country_dict = dict(self.manifest["countries"])
+        redlist.chiroptera_checklist = {
+            scientific_name: int(taxonid)
+            for scientific_name, taxonid in self.manifest["checklist"]
+        }
+        info_dict = {}
+        for taxonid in self.record_keys:
+            species_dict = self.get_species_dict(taxonid)
+            if species_dict is not None:
+                info_dict[species_dict["scientific_name"]] = species_dict
+        redlist.chiroptera_info_dict = info_dict
+        # Rows for each taxonid are used in stored order.
+        row_positions = {}
+        by_country_list = []
+        for taxonid in self.manifest["by_country_order"]:
+            position = row_positions.get(taxonid, 0)
+            row_positions[taxonid] = position + 1
+            record = self.get_record(taxonid)
+            by_country_list.append(list(record["by_country"][position]))
+        redlist.chiroptera_by_country_list = by_country_list
+        redlist.build_index()
+
+
+def diff_snapshots(old_snapshot, new_snapshot):
+    """ Compare two snapshots by taxonid. Returns rows with CHANGES_HEADER
+        columns, sorted by change and scientific name. Changes are "added",
+        "removed", "renamed", "category" and "countries".
+        The snapshots are joined on the taxonid dicts. Taxa with the same
+        record key are unchanged and are skipped without reading the
+        records, which is the case for most taxa between two versions. """
+    old_keys = old_snapshot.record_keys
+    new_keys = new_snapshot.record_keys
+    rows = []
+    for taxonid, new_key in new_keys.items():
+        old_key = old_keys.get(taxonid)
+        if old_key == new_key:
+            continue
+        new_species = new_snapshot.get_species_dict(taxonid) or {}
+        scientific_name = new_species.get("scientific_name", "")
+        if old_key is None:
+            rows.append(
+                ["added", taxonid, scientific_name, "", new_species.get("category", "")]
+            )
+            continue
+        old_species = old_snapshot.get_species_dict(taxonid) or {}
+        old_name = old_species.get("scientific_name", "")
+        if old_name != scientific_name:
+            rows.append(
+                ["renamed", taxonid, scientific_name, old_name, scientific_name]
+            )
+        old_category = old_species.get("category", "")
+        new_category = new_species.get("category", "")
+        if old_category != new_category:
+            rows.append(
+                ["category", taxonid, scientific_name, old_category, new_category]
+            )
+        old_countries = old_snapshot.get_countries(taxonid)
+        new_countries = new_snapshot.get_countries(taxonid)
+        if old_countries != new_countries:
+            rows.append(
+                [
+                    "countries",
+                    taxonid,
+                    scientific_name,
+                    ", ".join(old_countries),
+                    ", ".join(new_countries),
+                ]
+            )
+    for taxonid in old_keys:
+        if taxonid not in new_keys:
+            old_species = old_snapshot.get_species_dict(taxonid) or {}
+            rows.append(
+                [
+                    "removed",
+                    taxonid,
+                    old_species.get("scientific_name", ""),
+                    old_species.get("category", ""),
+                    "",
+                ]
+            )
+    rows.sort(key=lambda row: (row[0], row[2], row[1]))
+    return rows
+
+
+def make_record_key(record_content):
+    """ sha256 of the record content. """
+    record_string = json.dumps(record_content, separators=(",", ":"))
+    return hashlib.sha256(record_string.encode("utf-8")).hexdigest()
+
+
+def write_atomic(filepath, content_binary):
+    """ Write to a temp file and rename when done. """
+    tmp_path = filepath.with_name(
+        filepath.name + "." + str(threading.get_ident()) + ".tmp"
+    )
+    with tmp_path.open("wb") as file:
+        file.write(content_binary)
+    os.replace(tmp_path, filepath)
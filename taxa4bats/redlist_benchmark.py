@@ -0,0 +1,335 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import sys
+import json
+import math
+import time
+import shutil
+import hashlib
+import pathlib
+import zipfile
+import argparse
+import tempfile
+import threading
+import tracemalloc
+
+import iucn_redlist
+import redlist_mock_api
+
+STAGES = ["get_all_from_api", "save_all", "load_all", "create_excel"]
+
+
+def run_benchmark(
+    scale=1,
+    latency=0.0,
+    error_rate=0.0,
+    throttle_rate=0.0,
+    max_workers=8,
+    repeat=1,
+    trace_memory=True,
+    workdir=None,
+):
+    """ Run all stages against a local mock API, repeat times each.
+        Returns a dict with settings and one result per stage:
+        seconds (per run), throughput, latency percentiles, peak memory and
+        output digests. Peak memory is measured with tracemalloc, which makes
+        the stages slower. Use trace_memory=False for timing only. """
+    catalogue = redlist_mock_api.MockCatalogue(scale=scale)
+    api = redlist_mock_api.MockIucnApi(
+        catalogue,
+        latency=latency,
+        error_rate=error_rate,
+        throttle_rate=throttle_rate,
+    )
+    api_url = api.start()
+    tmp_dirpath = None
+    if workdir is None:
+        tmp_dirpath = tempfile.mkdtemp(prefix="redlist_benchmark_")
+        workdir = tmp_dirpath
+    data_dirpath = pathlib.Path(workdir, "data")
+    excel_dirpath = pathlib.Path(workdir, "excel")
+    excel_dirpath.mkdir(parents=True, exist_ok=True)
+    #
+    results = {
+        "settings": {
+            "scale": scale,
+            "taxa": catalogue.taxon_count,
+            "bats": catalogue.bat_count,
+            "latency": latency,
+            "error_rate": error_rate,
+            "throttle_rate": throttle_rate,
+            "max_workers": max_workers,
+            "repeat": repeat,
+            "python": sys.version.split()[0],
+            "started": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "stages": {},
+    }
+    try:
+        stage_runs = {stage: [] for stage in STAGES}
+        for _ in range(repeat):
+            # Fetch.
+            api.clear_stats()
+            redlist = iucn_redlist.IucnRedlist(
+                api_token="benchmark", api_url=api_url, max_workers=max_workers
+            )
+            request_seconds = time_requests(redlist)
+            run = measure(lambda: redlist.get_all_from_api(), trace_memory)
+            run["items"] = redlist.get_http_stats()["requests"]
+            run["request_seconds"] = request_seconds
+            run["api_stats"] = api.get_stats()
+            stage_runs["get_all_from_api"].append(run)
+            # Save.
+            run = measure(lambda: redlist.save_all(str(data_dirpath)), trace_memory)
+            run["items"] = get_row_count(redlist)
+            run["digests"] = get_file_digests(data_dirpath)
+            stage_runs["save_all"].append(run)
+            # Load.
+            loaded = iucn_redlist.IucnRedlist()
+            run = measure(lambda: loaded.load_all(str(data_dirpath)), trace_memory)
+            run["items"] = get_row_count(loaded)
+            # Saved again from the loaded data, to check that load_all
+            # gives the same data.
+            check_dirpath = pathlib.Path(workdir, "check")
+            loaded.save_all(str(check_dirpath))
+            run["digests"] = get_file_digests(check_dirpath)
+            stage_runs["load_all"].append(run)
+            # Excel.
+            for filepath in excel_dirpath.glob("*.xlsx"):
+                filepath.unlink()
+            run = measure(lambda: loaded.create_excel(str(excel_dirpath)), trace_memory)
+            run["items"] = get_row_count(loaded)
+            run["digests"] = {
+                filepath.name: get_excel_digest(filepath)
+                for filepath in excel_dirpath.glob("*.xlsx")
+            }
+            stage_runs["create_excel"].append(run)
+        #
+        for stage in STAGES:
+            results["stages"][stage] = summarize(stage_runs[stage])
+        save_digests = results["stages"]["save_all"]["digests"]
+        load_digests = results["stages"]["load_all"]["digests"]
+        results["stages"]["load_all"]["equal_to_saved"] = save_digests == load_digests
+    finally:
+        api.stop()
+        if tmp_dirpath:
+            shutil.rmtree(tmp_dirpath, ignore_errors=True)
+    return results
+
+
+def measure(function, trace_memory):
+    """ Returns a dict with seconds and peak memory for one call. """
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        function()
+        seconds = time.perf_counter() - started
+        peak_bytes = None
+        if trace_memory:
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return {"seconds": seconds, "peak_bytes": peak_bytes}
+
+
+def time_requests(redlist):
+    """ Records the time for each request made by redlist. Returns the list
+        with seconds, which is filled during get_all_from_api. """
+    request_seconds = []
+    lock = threading.Lock()
+    http_get = redlist.http_client.get
+
+    def timed_get(path, params=None):
+        started = time.perf_counter()
+        try:
+            return http_get(path, params)
+        finally:
+            with lock:
+                request_seconds.append(time.perf_counter() - started)
+
+    redlist.http_client.get = timed_get
+    return request_seconds
+
+
+def summarize(runs):
+    """ One result for all runs of a stage. """
+    seconds = [run["seconds"] for run in runs]
+    seconds_p50 = percentile(seconds, 50)
+    items = runs[-1]["items"]
+    result = {
+        "runs": len(runs),
+        "seconds": seconds,
+        "seconds_p50": seconds_p50,
+        "items": items,
+        "items_per_second": items / seconds_p50 if seconds_p50 else None,
+        "peak_bytes": max(
+            [run["peak_bytes"] for run in runs if run["peak_bytes"] is not None],
+            default=None,
+        ),
+    }
+    request_seconds = []
+    for run in runs:
+        request_seconds += run.get("request_seconds", [])
+    if request_seconds:
+        result["request_latency"] = {
+            "p50": percentile(request_seconds, 50),
+            "p90": percentile(request_seconds, 90),
+            "p99": percentile(request_seconds, 99),
+            "max": max(request_seconds),
+        }
+        result["api_stats"] = runs[-1]["api_stats"]
+    if "digests" in runs[-1]:
+        result["digests"] = runs[-1]["digests"]
+        # All repeated runs must give the same output.
+        result["equal_runs"] = all(run["digests"] == runs[0]["digests"] for run in runs)
+    return result
+
+
+def percentile(values, percent):
+    """ Nearest-rank percentile. """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, math.ceil(percent / 100.0 * len(values)))
+    return values[min(rank, len(values)) - 1]
+
+
+def get_row_count(redlist):
+    """ Species info rows plus species by country rows. """
+    return len(redlist.get_chiroptera_info_dict()) + len(
+        redlist.get_chiroptera_by_country_list()
+    )
+
+
+def get_file_digests(dirpath):
+    """ sha256 for each file in a directory. """
+    return {
+        filepath.name: hashlib.sha256(filepath.read_bytes()).hexdigest()
+        for filepath in sorted(pathlib.Path(dirpath).iterdir())
+        if filepath.is_file()
+    }
+
+
+def get_excel_digest(filepath):
+    """ sha256 of the worksheets. Other parts of the file contain the
+        creation time. """
+    digest = hashlib.sha256()
+    with zipfile.ZipFile(filepath) as excel_zip:
+        for name in sorted(excel_zip.namelist()):
+            if name.startswith("xl/worksheets/") or name == "xl/sharedStrings.xml":
+                digest.update(name.encode("utf-8"))
+                digest.update(excel_zip.read(name))
+    return digest.hexdigest()
+
+
+def compare_results(old_results, new_results):
+    """ Returns rows with stage, old and new median seconds, ratio, and if
+        the output is equal. Used to compare runs over time. """
+    rows = []
+    for stage in STAGES:
+        old_stage = old_results["stages"].get(stage, {})
+        new_stage = new_results["stages"].get(stage, {})
+        old_seconds = old_stage.get("seconds_p50")
+        new_seconds = new_stage.get("seconds_p50")
+        ratio = None
+        if old_seconds and new_seconds:
+            ratio = new_seconds / old_seconds
+        equal_output = None
+        if ("digests" in old_stage) and ("digests" in new_stage):
+            equal_output = old_stage["digests"] == new_stage["digests"]
+        rows.append([stage, old_seconds, new_seconds, ratio, equal_output])
+    return rows
+
+
+def format_report(results, compare_rows=None):
+    """ Text report for results from run_benchmark. """
+    settings = results["settings"]
+    lines = [
+        "Scale: "
+        + str(settings["scale"])
+        + "   Taxa: "
+        + str(settings["taxa"])
+        + "   Bats: "
+        + str(settings["bats"])
+        + "   Latency: "
+        + str(settings["latency"])
+        + "   Error rate: "
+        + str(settings["error_rate"])
+        + "   Workers: "
+        + str(settings["max_workers"]),
+    ]
+    for stage, result in results["stages"].items():
+        line = (
+            stage.ljust(18)
+            + "{:9.3f} s".format(result["seconds_p50"])
+            + "{:12.0f} items/s".format(result["items_per_second"] or 0)
+        )
+        if result["peak_bytes"] is not None:
+            line += "{:9.1f} MB peak".format(result["peak_bytes"] / 1024 / 1024)
+        if "request_latency" in result:
+            latency = result["request_latency"]
+            line += "   requests p50/p90/p99: " + "/".join(
+                "{:.1f}".format(latency[key] * 1000) for key in ["p50", "p90", "p99"]
+            )
+            line += " ms"
+        if "equal_runs" in result:
+            line += "   equal runs: " + str(result["equal_runs"])
+        if "equal_to_saved" in result:
+            line += "   equal to saved: " + str(result["equal_to_saved"])
+        lines.append(line)
+    for stage, old_seconds, new_seconds, ratio, equal_output in compare_rows or []:
+        lines.append(
+            "Compared: "
+            + stage.ljust(18)
+            + ("{:.2f}x".format(ratio) if ratio else "-")
+            + "   equal output: "
+            + str(equal_output)
+        )
+    return "\n".join(lines)
+
+
+def main(args=None):
+    """ """
+    parser = argparse.ArgumentParser(
+        description="Benchmark IucnRedlist stages against a local mock API."
+    )
+    parser.add_argument("--scale", type=float, default=1, help="1, 10 or 100.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds.")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--no-memory", action="store_true", help="No tracemalloc.")
+    parser.add_argument("--output", help="Save results as JSON.")
+    parser.add_argument("--compare", help="JSON results from an earlier run.")
+    options = parser.parse_args(args)
+    #
+    results = run_benchmark(
+        scale=options.scale,
+        latency=options.latency,
+        error_rate=options.error_rate,
+        throttle_rate=options.throttle_rate,
+        max_workers=options.workers,
+        repeat=options.repeat,
+        trace_memory=not options.no_memory,
+    )
+    compare_rows = None
+    if options.compare:
+        with open(options.compare, "r") as file:
+            compare_rows = compare_results(json.load(file), results)
+    print(format_report(results, compare_rows))
+    if options.output:
+        with open(options.output, "w") as file:
+            json.dump(results, file, indent=1)
+
+
+### Main. ###
+if __name__ == "__main__":
+    """ """
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import os
+import json
+import time
+import zlib
+import hashlib
+import pathlib
+import threading
+
+
+class ResponseCache(object):
+    """ On-disk cache for raw API responses.
+        Entries are keyed by Red List version, endpoint path and parameters.
+        Each entry is stored zlib compressed in a file named by the sha256 of
+        the key. Entries older than ttl seconds are not used, and the least
+        recently used entries are removed when max_bytes is exceeded. """
+
+    def __init__(self, dirpath, ttl=365 * 24 * 3600, max_bytes=500 * 1024 * 1024):
+        """ """
+        self.dirpath = pathlib.Path(dirpath)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        #
+        self.lock = threading.Lock()
+        self.index_file = pathlib.Path(self.dirpath, "cache_index.json")
+        self.index = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        #
+        self.load_index()
+
+    def make_key(self, version, path, params=None):
+        """ Content address for one request. Tokens are not part of the key. """
+        key_params = sorted((params or {}).items())
+        key_string = json.dumps([version, path, key_params])
+        return hashlib.sha256(key_string.encode("utf-8")).hexdigest()
+
+    def get(self, version, path, params=None, ttl=None):
+        """ Returns the cached response as bytes, or None if missing or expired. """
+        key = self.make_key(version, path, params)
+        if ttl is None:
+            ttl = self.ttl
+        now = time.time()
+        with self.lock:
+            entry = self.index.get(key)
+            if (entry is None) or (now - entry["created"] > ttl):
+                self.misses += 1
+                return None
+            entry["accessed"] = now
+        try:
+            with self.entry_path(key).open("rb") as file:
+                response_binary = zlib.decompress(file.read())
+        except (OSError, zlib.error):
+            # Removed or broken file. Handle as a cache miss.
+            with self.lock:
+                self.remove_entry(key)
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return response_binary
+
+    def put(self, version, path, response_binary, params=None):
+        """ Store one response. The file is written to a temp file and renamed. """
+        key = self.make_key(version, path, params)
+        entry_path = self.entry_path(key)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        compressed = zlib.compress(response_binary)
+        tmp_path = entry_path.with_name(
+            entry_path.name + "." + str(threading.get_ident()) + ".tmp"
+        )
+        with tmp_path.open("wb") as file:
+            file.write(compressed)
+        os.replace(tmp_path, entry_path)
+        #
+        now = time.time()
+        with self.lock:
+            self.remove_entry(key, delete_file=False)
+            self.index[key] = {"size": len(compressed), "created": now, "accessed": now}
+            self.total_bytes += len(compressed)
+            self.evict()
+
+    def evict(self):
+        """ Remove least recently used entries until total size <= max_bytes.
+            Must be called with the lock held. """
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key in sorted(self.index, key=lambda k: self.index[k]["accessed"]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            self.remove_entry(key)
+
+    def remove_entry(self, key, delete_file=True):
+        """ Must be called with the lock held. """
+        entry = self.index.pop(key, None)
+        if entry is None:
+            return
+        self.total_bytes -= entry["size"]
+        if delete_file:
+            try:
+                self.entry_path(key).unlink()
+            except OSError:
+                pass
+
+    def entry_path(self, key):
+        """ """
+        return pathlib.Path(self.dirpath, key[0:2], key + ".zlib")
+
+    def get_stats(self):
+        """ """
+        with self.lock:
+            return {
+                "entries": len(self.index),
+                "total_bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def load_index(self):
+        """ Read the index. Entry files not in the index, for example after an
+            interrupted run, are added with the file time as created time. """
+        self.index = {}
+        if self.index_file.exists():
+            try:
+                with self.index_file.open("r") as file:
+                    self.index = json.load(file)
+            except ValueError:
+                self.index = {}
+        #
+        if self.dirpath.exists():
+            for entry_path in self.dirpath.glob("??/*.zlib"):
+                key = entry_path.stem
+                if key not in self.index:
+                    stat = entry_path.stat()
+                    self.index[key] = {
+                        "size": stat.st_size,
+                        "created": stat.st_mtime,
+                        "accessed": stat.st_mtime,
+                    }
+        self.total_bytes = sum(entry["size"] for entry in self.index.values())
+        with self.lock:
+            self.evict()
+
+    def save_index(self):
+        """ Write the index, including access times used for eviction. """
+        self.dirpath.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            index_string = json.dumps(self.index)
+        tmp_path = self.index_file.with_name(self.index_file.name + ".tmp")
+        with tmp_path.open("w") as file:
+            file.write(index_string)
+        os.replace(tmp_path, self.index_file)
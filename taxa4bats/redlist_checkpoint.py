@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import os
+import json
+import pathlib
+import threading
+
+
+class CheckpointJournal(object):
+    """ Append-only journal of completed work in get_all_from_api.
+        Each line is a JSON list [phase, key, data], where data is the
+        result needed to rebuild the in-memory state without a new request.
+        An incomplete last line, from an interrupted write, is ignored and
+        removed when the journal is resumed. """
+
+    def __init__(self, filepath):
+        """ """
+        self.filepath = pathlib.Path(filepath)
+        self.lock = threading.Lock()
+        self.file = None
+        self.completed = {}
+
+    def open(self, resume=False):
+        """ Start a new journal, or continue the existing one if resume=True. """
+        self.completed = {}
+        if resume and self.filepath.exists():
+            # Byte offset after the last complete line.
+            offset = 0
+            with self.filepath.open("rb") as file:
+                for row in file:
+                    if not row.endswith(b"\n"):
+                        break
+                    try:
+                        phase, key, data = json.loads(row)
+                    except ValueError:
+                        break
+                    self.completed.setdefault(phase, {})[key] = data
+                    offset += len(row)
+            # New lines must not be appended to an incomplete line.
+            os.truncate(self.filepath, offset)
+        else:
+            if not self.filepath.parent.exists():
+                self.filepath.parent.mkdir(parents=True)
+            self.filepath.write_text("")
+        #
+        self.file = self.filepath.open("a")
+
+    def check_version(self, version):
+        """ Work done for another Red List version can't be reused. """
+        if self.completed.get("version", {}).get("") == version:
+            return
+        if self.completed:
+            self.completed = {}
+            self.file.close()
+            self.filepath.write_text("")
+            self.file = self.filepath.open("a")
+        self.record("version", "", version)
+
+    def get_completed(self, phase):
+        """ Returns a dict with key: data for completed work in phase. """
+        return self.completed.get(phase, {})
+
+    def record(self, phase, key, data):
+        """ Add one completed item. Flushed directly to survive a crash. """
+        key = str(key)
+        with self.lock:
+            self.file.write(json.dumps([phase, key, data]) + "\n")
+            self.file.flush()
+            self.completed.setdefault(phase, {})[key] = data
+
+    def close(self):
+        """ """
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        """ Remove the journal when all work is done. """
+        self.close()
+        if self.filepath.exists():
+            self.filepath.unlink()
@@ -0,0 +1,392 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import os
+import sys
+import json
+import pathlib
+import argparse
+
+import iucn_redlist
+import redlist_records
+
+# The API token is read from this environment variable, or from the
+# config file. Example config file:
+#   [iucn_redlist]
+#   token = <YOUR TOKEN>
+TOKEN_VARIABLE = "IUCN_REDLIST_TOKEN"
+CONFIG_FILEPATH = "~/.config/taxa4bats/config.ini"
+
+API_URL = "https://apiv3.iucnredlist.org/api/v3"
+DATA_DIRPATH = "taxa4bats/data"
+
+# Columns printed for species lists.
+SPECIES_COLUMNS = [
+    "scientific_name",
+    "taxonid",
+    "family",
+    "category",
+    "main_common_name",
+]
+
+
+def main(args=None):
+    """ Command line entry point. Returns the exit status.
+        Examples:
+            python taxa4bats/redlist_cli.py fetch --resume
+            python taxa4bats/redlist_cli.py export --formats xlsx csv
+            python taxa4bats/redlist_cli.py query --country SE --category EN
+            python taxa4bats/redlist_cli.py query --species "Myotis daubentonii"
+            python taxa4bats/redlist_cli.py diff
+        Without a command, data is fetched if there is a token, and the
+        Excel file is created. """
+    parser = create_parser()
+    options = parser.parse_args(args)
+    try:
+        return options.function(options)
+    except ValueError as e:
+        parser.exit(2, parser.prog + ": error: " + str(e) + "\n")
+
+
+def create_parser():
+    """ """
+    parser = argparse.ArgumentParser(
+        prog="taxa4bats",
+        description="Bats (Chiroptera) from the IUCN Red List of Threatened Species.",
+    )
+    parser.add_argument(
+        "--data-dir", default=DATA_DIRPATH, help="Saved data. Default: %(default)s."
+    )
+    parser.add_argument(
+        "--config",
+        default=CONFIG_FILEPATH,
+        help="Config file with the API token, used if "
+        + TOKEN_VARIABLE
+        + " is not set. Default: %(default)s.",
+    )
+    parser.set_defaults(function=run_update)
+    subparsers = parser.add_subparsers(title="commands")
+    #
+    fetch_parser = subparsers.add_parser(
+        "fetch", help="Get all data from the IUCN Red List API and save it."
+    )
+    fetch_parser.add_argument("--workers", type=int, default=8)
+    fetch_parser.add_argument(
+        "--resume", action="store_true", help="Continue an interrupted fetch."
+    )
+    fetch_parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Request species info for all species, not only changed species.",
+    )
+    fetch_parser.add_argument(
+        "--strategy",
+        default="auto",
+        choices=["auto", "country", "species"],
+        help="Requests for species by country. Default: %(default)s.",
+    )
+    fetch_parser.add_argument("--requests-per-second", type=float)
+    fetch_parser.add_argument(
+        "--no-cache", action="store_true", help="No raw response cache."
+    )
+    fetch_parser.add_argument("--storage", default="tsv", choices=["tsv", "sqlite"])
+    fetch_parser.add_argument(
+        "--no-archive", action="store_true", help="Don't add to the version archive."
+    )
+    fetch_parser.add_argument("--api-url", default=API_URL)
+    fetch_parser.add_argument("--metrics", help="Save a metrics report as JSON.")
+    fetch_parser.add_argument("--debug", action="store_true")
+    fetch_parser.set_defaults(function=run_fetch)
+    #
+    export_parser = subparsers.add_parser("export", help="Export the saved data.")
+    export_parser.add_argument(
+        "--output-dir", default=".", help="Default: %(default)s."
+    )
+    export_parser.add_argument(
+        "--formats",
+        nargs="+",
+        default=["xlsx"],
+        help="xlsx, csv, jsonl and/or columnar. Default: %(default)s.",
+    )
+    export_parser.add_argument(
+        "--no-changes",
+        action="store_true",
+        help="No sheet with changes since the previous archived version.",
+    )
+    export_parser.add_argument("--workers", type=int)
+    export_parser.set_defaults(function=run_export)
+    #
+    query_parser = subparsers.add_parser(
+        "query", help="Look up species in the saved data."
+    )
+    query_parser.add_argument("--species", help="Scientific name.")
+    query_parser.add_argument(
+        "--search", help="Name or part of name, may be misspelled."
+    )
+    query_parser.add_argument("--country", help="Country isocode, for example SE.")
+    query_parser.add_argument("--category", help="Red List category, for example EN.")
+    query_parser.add_argument("--family")
+    query_parser.add_argument("--limit", type=int, default=10, help="For --search.")
+    query_parser.add_argument("--storage", default="tsv", choices=["tsv", "sqlite"])
+    query_parser.add_argument("--json", action="store_true")
+    query_parser.set_defaults(function=run_query)
+    #
+    diff_parser = subparsers.add_parser(
+        "diff", help="Changes between archived versions."
+    )
+    diff_parser.add_argument(
+        "--old", help="Default: the archived version before the new version."
+    )
+    diff_parser.add_argument("--new", help="Default: the saved data.")
+    diff_parser.add_argument(
+        "--list", action="store_true", help="List the archived versions."
+    )
+    diff_parser.add_argument("--json", action="store_true")
+    diff_parser.set_defaults(function=run_diff)
+    return parser
+
+
+def get_token(config_filepath=CONFIG_FILEPATH):
+    """ API token from the environment or from the config file.
+        Returns None if not found. """
+    token = os.environ.get(TOKEN_VARIABLE, "").strip()
+    if token:
+        return token
+    config_path = pathlib.Path(config_filepath).expanduser()
+    if not config_path.exists():
+        return None
+    import configparser
+
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    return config.get("iucn_redlist", "token", fallback="").strip() or None
+
+
+def get_archive_dirpath(options):
+    """ """
+    return pathlib.Path(options.data_dir, "archive")
+
+
+def run_update(options):
+    """ Default command. Fetch if there is a token, then create the Excel
+        file with changes. """
+    if get_token(options.config):
+        fetch_options = create_parser().parse_args(
+            ["--data-dir", options.data_dir, "--config", options.config]
+            + ["fetch", "--resume"]
+        )
+        run_fetch(fetch_options)
+    else:
+        print("No API token found. Saved data is used.")
+    redlist = load_redlist(options)
+    redlist.create_excel(changes=redlist.get_changes(get_archive_dirpath(options)))
+    print("Done. ", redlist.get_redlist_citation())
+    return 0
+
+
+def run_fetch(options):
+    """ """
+    token = get_token(options.config)
+    if not token:
+        raise ValueError(
+            "No API token. Set " + TOKEN_VARIABLE + " or add it to " + options.config
+        )
+    data_dirpath = pathlib.Path(options.data_dir)
+    data_dirpath.mkdir(parents=True, exist_ok=True)
+    metrics = None
+    if options.metrics:
+        import redlist_metrics
+
+        metrics = redlist_metrics.Metrics(report_filepath=options.metrics)
+        if options.debug:
+            metrics.add_callback(redlist_metrics.print_event)
+    cache_dirpath = None
+    if not options.no_cache:
+        cache_dirpath = str(pathlib.Path(data_dirpath, "response_cache"))
+    redlist = iucn_redlist.IucnRedlist(
+        api_token=token,
+        debug=options.debug,
+        max_workers=options.workers,
+        cache_dirpath=cache_dirpath,
+        checkpoint_filepath=str(pathlib.Path(data_dirpath, "redlist_checkpoint.jsonl")),
+        by_country_strategy=options.strategy,
+        requests_per_second=options.requests_per_second,
+        metrics=metrics,
+        api_url=options.api_url,
+    )
+    # This will take some time since all taxa must be checked to find out
+    # if they belong to Chiroptera.
+    delta_dirpath = None if options.full else str(data_dirpath)
+    redlist.get_all_from_api(resume=options.resume, delta_dirpath=delta_dirpath)
+    redlist.save_all(dirpath=str(data_dirpath), storage=options.storage)
+    if not options.no_archive:
+        redlist.archive_snapshot(get_archive_dirpath(options))
+    print(
+        "Version: "
+        + redlist.get_redlist_version()
+        + "   Species: "
+        + str(len(redlist.get_chiroptera_info_dict()))
+        + "   Species by country: "
+        + str(len(redlist.get_chiroptera_by_country_list()))
+    )
+    return 0
+
+
+def run_export(options):
+    """ All formats are written in parallel by redlist_export. The Excel
+        file gets a sheet for changes since the previous archived version. """
+    import redlist_export
+
+    for export_format in options.formats:
+        if export_format not in redlist_export.EXPORT_FORMATS:
+            raise ValueError("Unknown export format: " + export_format)
+    redlist = load_redlist(options)
+    changes = None
+    if ("xlsx" in options.formats) and not options.no_changes:
+        changes = redlist.get_changes(get_archive_dirpath(options))
+    redlist.export_all(
+        dirpath=options.output_dir,
+        formats=list(options.formats),
+        max_workers=options.workers,
+        changes=changes,
+    )
+    return 0
+
+
+def run_query(options):
+    """ Only the saved files needed for the query are read. """
+    redlist = load_redlist(options, lazy=True)
+    country = options.country.upper() if options.country else None
+    category = options.category.upper() if options.category else None
+    if options.species:
+        species_dict = redlist.get_species_info(options.species)
+        if species_dict is None:
+            print("Species not found: " + options.species, file=sys.stderr)
+            matches = redlist.get_search_index(options.data_dir).search(
+                options.species, limit=5
+            )
+            if matches:
+                print(
+                    "Did you mean: "
+                    + ", ".join(match["scientific_name"] for match in matches),
+                    file=sys.stderr,
+                )
+            return 1
+        content = {
+            item: redlist_records.text_value(species_dict.get(item, ""))
+            for item in redlist.chiroptera_info_header
+        }
+        content["countries"] = redlist.get_species_countries(options.species)
+        if options.json:
+            print(json.dumps(content, ensure_ascii=False, indent=1))
+        else:
+            for item, value in content.items():
+                if isinstance(value, list):
+                    value = ", ".join(value)
+                print(item + "\t" + str(value))
+        return 0
+    #
+    if options.search:
+        index = redlist.get_search_index(options.data_dir)
+        matches = index.search(
+            options.search,
+            limit=options.limit,
+            family=options.family,
+            category=category,
+            country=country,
+        )
+        header = ["scientific_name", "name", "field", "match", "distance"]
+        rows = [[match[item] for item in header] for match in matches]
+        print_rows(header, rows, options.json)
+        return 0
+    #
+    if not (options.country or options.category or options.family):
+        raise ValueError(
+            "Use --species, --search, --country, --category and/or --family."
+        )
+    scientific_names = redlist.query_species(
+        country=country, category=category, family=options.family
+    )
+    rows = []
+    for scientific_name in scientific_names:
+        species_dict = redlist.get_species_info(scientific_name)
+        rows.append(
+            [
+                redlist_records.text_value(species_dict.get(item, ""))
+                for item in SPECIES_COLUMNS
+            ]
+        )
+    print_rows(SPECIES_COLUMNS, rows, options.json)
+    return 0
+
+
+def run_diff(options):
+    """ Changes from an archived version to the saved data, or between two
+        archived versions. """
+    import redlist_archive
+
+    archive = redlist_archive.SnapshotArchive(get_archive_dirpath(options))
+    versions = archive.get_versions()
+    if options.list:
+        for version in versions:
+            print(version)
+        return 0
+    if options.new is None:
+        redlist = load_redlist(options, lazy=True)
+        rows = redlist.get_changes(archive.dirpath, old_version=options.old)
+    else:
+        old_version = options.old
+        if old_version is None:
+            old_versions = [version for version in versions if version < options.new]
+            if not old_versions:
+                raise ValueError("No archived version before " + options.new + ".")
+            old_version = old_versions[-1]
+        rows = redlist_archive.diff_snapshots(
+            archive.get_snapshot(old_version), archive.get_snapshot(options.new)
+        )
+    print_rows(redlist_archive.CHANGES_HEADER, rows, options.json)
+    return 0
+
+
+def load_redlist(options, lazy=False):
+    """ Saved data from the data directory. Use lazy=True for short
+        queries. Only the files used are read. """
+    storage = getattr(options, "storage", "tsv")
+    redlist = iucn_redlist.IucnRedlist()
+    if storage == "sqlite":
+        data_path = redlist.get_taxon_path(options.data_dir, ".sqlite")
+    else:
+        data_path = pathlib.Path(options.data_dir, "redlist_version.txt")
+    if not data_path.exists():
+        raise ValueError(
+            "No saved data in " + str(options.data_dir) + ". Run fetch first."
+        )
+    # Compact records are slower to create and only save memory for
+    # long running processes.
+    redlist.load_all(
+        dirpath=options.data_dir, storage=storage, lazy=lazy, compact=not lazy
+    )
+    return redlist
+
+
+def print_rows(header, rows, as_json=False):
+    """ Tab separated with header, or JSON with one object per row. """
+    if as_json:
+        print(
+            json.dumps(
+                [dict(zip(header, row)) for row in rows], ensure_ascii=False, indent=1
+            )
+        )
+        return
+    print("\t".join(header))
+    for row in rows:
+        print("\t".join(str(value) for value in row))
+
+
+### Main. ###
+if __name__ == "__main__":
+    """ """
+    sys.exit(main())
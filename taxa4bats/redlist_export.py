@@ -0,0 +1,255 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import os
+import csv
+import gzip
+import json
+import shutil
+import pathlib
+import tempfile
+import contextlib
+import concurrent.futures
+
+import redlist_records
+
+EXPORT_FORMATS = ["xlsx", "csv", "jsonl", "columnar"]
+
+
+def export_all(redlist, dirpath=".", formats=None, max_workers=None, changes=None):
+    """ Export one loaded IucnRedlist in several formats. Each format is
+        written by its own process, from the same snapshot. Files are
+        written to temp files and renamed when complete. Rows from
+        get_changes are added as a sheet in the xlsx file if changes is given.
+        Returns a dict with format: list of written files. """
+    formats = formats or EXPORT_FORMATS
+    for export_format in formats:
+        if export_format not in WRITERS:
+            raise ValueError("Unknown export format: " + str(export_format))
+    pathlib.Path(dirpath).mkdir(parents=True, exist_ok=True)
+    snapshot = get_snapshot(redlist)
+    snapshot["changes"] = changes
+    #
+    result = {}
+    if (max_workers == 1) or (len(formats) == 1):
+        for export_format in formats:
+            result[export_format] = WRITERS[export_format](snapshot, str(dirpath))
+        return result
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers or len(formats)
+    ) as executor:
+        futures = {
+            export_format: executor.submit(
+                WRITERS[export_format], snapshot, str(dirpath)
+            )
+            for export_format in formats
+        }
+        for export_format, future in futures.items():
+            result[export_format] = future.result()
+    return result
+
+
+def get_snapshot(redlist):
+    """ All data needed by the writers as plain lists and dicts, which
+        can be sent to other processes. Species are sorted once. """
+    redlist.check_info_columns(redlist.chiroptera_info_header, "export")
+    info_dict = redlist.get_chiroptera_info_dict()
+    by_country_list = redlist.get_chiroptera_by_country_list()
+    index = redlist.get_index()
+    #
+    species_rows = []
+    countries_by_species = []
+    for key in sorted(info_dict.keys()):
+        species_dict = info_dict[key]
+        species_rows.append(
+            [
+                redlist_records.text_value(species_dict.get(item, ""))
+                for item in redlist.chiroptera_info_header
+            ]
+        )
+        countries_by_species.append(
+            list(index.get_countries(species_dict.get("taxonid", "")))
+        )
+    #
+    return {
+        "taxon_name": redlist.taxon_name,
+        "version": redlist.get_redlist_version(),
+        "citation": redlist.get_redlist_citation(),
+        "summary_header": list(redlist.chiroptera_summary_header),
+        "info_header": list(redlist.chiroptera_info_header),
+        "country_header": list(redlist.country_header),
+        "by_country_header": list(redlist.chiroptera_by_country_header),
+        "species_rows": species_rows,
+        "countries_by_species": countries_by_species,
+        "countries": sorted(redlist.get_country_dict().items()),
+        "by_country_rows": sorted(list(row) for row in by_country_list),
+    }
+
+
+@contextlib.contextmanager
+def atomic_path(filepath):
+    """ Yields a temp path in the same directory. It is renamed to filepath
+        when the block is done, and removed if the block fails. """
+    filepath = pathlib.Path(filepath)
+    tmp_name = "." + filepath.name + "." + str(os.getpid()) + ".tmp"
+    tmp_path = filepath.with_name(tmp_name)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, filepath)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def write_xlsx(snapshot, dirpath):
+    """ """
+    import iucn_redlist
+
+    redlist = iucn_redlist.IucnRedlist(taxon_name=snapshot["taxon_name"])
+    redlist.version = snapshot["version"]
+    info_header = snapshot["info_header"]
+    for values in snapshot["species_rows"]:
+        species_dict = dict(zip(info_header, values))
+        redlist.chiroptera_info_dict[species_dict["scientific_name"]] = species_dict
+    redlist.country_dict = dict(snapshot["countries"])
+    redlist.chiroptera_by_country_list = snapshot["by_country_rows"]
+    # create_excel selects the file name. Written to a temp directory
+    # on the same file system, and moved when done.
+    tmp_dirpath = tempfile.mkdtemp(prefix=".export_", dir=dirpath)
+    try:
+        redlist.create_excel(tmp_dirpath, changes=snapshot.get("changes"))
+        filepaths = []
+        for tmp_filepath in pathlib.Path(tmp_dirpath).iterdir():
+            filepath = pathlib.Path(dirpath, tmp_filepath.name)
+            os.replace(tmp_filepath, filepath)
+            filepaths.append(str(filepath))
+    finally:
+        shutil.rmtree(tmp_dirpath, ignore_errors=True)
+    return filepaths
+
+
+def write_csv(snapshot, dirpath):
+    """ One CSV file for each data sheet. """
+    summary_rows = []
+    for values, countries in zip(
+        snapshot["species_rows"], snapshot["countries_by_species"]
+    ):
+        species_dict = dict(zip(snapshot["info_header"], values))
+        species_dict["family"] = species_dict.get("family", "").capitalize()
+        species_dict["countries"] = ", ".join(countries)
+        summary_rows.append(
+            [species_dict.get(item, "") for item in snapshot["summary_header"]]
+        )
+    sheets = [
+        ("summary", snapshot["summary_header"], summary_rows),
+        ("info", snapshot["info_header"], snapshot["species_rows"]),
+        ("countries", snapshot["country_header"], snapshot["countries"]),
+        ("by_country", snapshot["by_country_header"], snapshot["by_country_rows"]),
+    ]
+    filepaths = []
+    for sheet_name, header, rows in sheets:
+        filepath = pathlib.Path(
+            dirpath,
+            "redlist_"
+            + snapshot["taxon_name"]
+            + "_"
+            + sheet_name
+            + "_"
+            + snapshot["version"]
+            + ".csv",
+        )
+        with atomic_path(filepath) as tmp_path:
+            with tmp_path.open("w", newline="", encoding="utf-8") as file:
+                writer = csv.writer(file)
+                writer.writerow(header)
+                writer.writerows(rows)
+        filepaths.append(str(filepath))
+    return filepaths
+
+
+def write_jsonl(snapshot, dirpath):
+    """ One JSON object per species, with typed numbers and a list of
+        country isocodes. """
+    filepath = pathlib.Path(
+        dirpath,
+        "redlist_" + snapshot["taxon_name"] + "_" + snapshot["version"] + ".jsonl",
+    )
+    info_header = snapshot["info_header"]
+    with atomic_path(filepath) as tmp_path:
+        with tmp_path.open("w", encoding="utf-8") as file:
+            for values, countries in zip(
+                snapshot["species_rows"], snapshot["countries_by_species"]
+            ):
+                species_dict = {
+                    item: typed_value(item, value)
+                    for item, value in zip(info_header, values)
+                }
+                species_dict["countries"] = countries
+                file.write(json.dumps(species_dict, ensure_ascii=False) + "\n")
+    return [str(filepath)]
+
+
+def write_columnar(snapshot, dirpath):
+    """ Gzipped JSON with one list per column. Text columns with repeated
+        values are dictionary encoded as {"dictionary": [...], "codes": [...]}. """
+    filepath = pathlib.Path(
+        dirpath,
+        "redlist_"
+        + snapshot["taxon_name"]
+        + "_"
+        + snapshot["version"]
+        + ".columns.json.gz",
+    )
+    species_rows = snapshot["species_rows"]
+    columns = {}
+    for position, item in enumerate(snapshot["info_header"]):
+        values = [typed_value(item, values[position]) for values in species_rows]
+        columns[item] = encode_column(values)
+    columns["countries"] = snapshot["countries_by_species"]
+    by_country_rows = snapshot["by_country_rows"]
+    by_country_columns = {}
+    for position, item in enumerate(snapshot["by_country_header"]):
+        values = [typed_value(item, row[position]) for row in by_country_rows]
+        by_country_columns[item] = encode_column(values)
+    #
+    content = {
+        "version": snapshot["version"],
+        "citation": snapshot["citation"],
+        "species": columns,
+        "countries": dict(snapshot["countries"]),
+        "by_country": by_country_columns,
+    }
+    with atomic_path(filepath) as tmp_path:
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as file:
+            json.dump(content, file, ensure_ascii=False, separators=(",", ":"))
+    return [str(filepath)]
+
+
+def encode_column(values):
+    """ Dictionary encoding if there are few distinct values. """
+    distinct_values = list(dict.fromkeys(values))
+    if len(distinct_values) > len(values) // 2:
+        return values
+    codes = {value: code for code, value in enumerate(distinct_values)}
+    return {
+        "dictionary": distinct_values,
+        "codes": [codes[value] for value in values],
+    }
+
+
+def typed_value(item, value):
+    """ Numbers for numeric columns and None for empty numbers. """
+    if item in redlist_records.NUMERIC_COLUMNS:
+        return redlist_records.to_number(value)
+    return value
+
+
+WRITERS = {
+    "xlsx": write_xlsx,
+    "csv": write_csv,
+    "jsonl": write_jsonl,
+    "columnar": write_columnar,
+}
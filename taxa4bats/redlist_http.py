@@ -0,0 +1,382 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import json
+import time
+import random
+import threading
+import zlib
+import email.utils
+import http.client
+import urllib.error
+import urllib.parse
+
+# Status codes for throttling and temporary server problems. Requests with
+# these status codes are retried.
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+class HttpClient(object):
+    """ Small HTTP client with reusable keep-alive connections per host.
+        Responses are requested gzip compressed and decompressed while read.
+        Connections are not shared between threads, but returned to a pool
+        after each request and reused by the next caller. """
+
+    def __init__(
+        self,
+        base_url,
+        max_idle_connections=16,
+        timeout=60,
+        max_concurrency=None,
+        requests_per_second=None,
+        max_retries=5,
+        backoff_base=0.5,
+        backoff_cap=60.0,
+        metrics=None,
+    ):
+        """ Counters and timings are recorded in metrics, a
+            redlist_metrics.Metrics object, if given. """
+        self.base_url = base_url.rstrip("/")
+        self.max_idle_connections = max_idle_connections
+        self.timeout = timeout
+        # Shared by all threads using this client.
+        self.rate_limiter = TokenBucket(requests_per_second)
+        self.concurrency = AimdController(max_concurrency or max_idle_connections)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.metrics = metrics
+        #
+        parsed_url = urllib.parse.urlsplit(self.base_url)
+        self.scheme = parsed_url.scheme
+        self.host = parsed_url.hostname
+        self.port = parsed_url.port
+        self.base_path = parsed_url.path
+        #
+        self.lock = threading.Lock()
+        self.idle_connections = {}
+        self.clear_stats()
+
+    def clear_stats(self):
+        """ """
+        with self.lock:
+            self.stats = {
+                "requests": 0,
+                "connections_opened": 0,
+                "connections_reused": 0,
+                "bytes_received": 0,
+                "bytes_decoded": 0,
+                "retries": 0,
+                "throttled": 0,
+            }
+
+    def get_stats(self):
+        """ Returns a copy of the counters since last clear_stats(). """
+        with self.lock:
+            stats = dict(self.stats)
+        stats["concurrency_limit"] = self.concurrency.get_limit()
+        return stats
+
+    def get_json(self, path, params=None):
+        """ GET path below base_url and decode the JSON response.
+            Returns {} for empty responses. """
+        return self.decode_json(path, self.get(path, params))
+
+    def decode_json(self, path, response_binary):
+        """ Decode a JSON response. Returns {} for empty responses. """
+        if not response_binary:
+            return {}
+        if not self.metrics:
+            return json.loads(response_binary.decode("utf-8"))
+        started = time.perf_counter()
+        content = json.loads(response_binary.decode("utf-8"))
+        self.metrics.record_decode(path, time.perf_counter() - started)
+        return content
+
+    def get(self, path, params=None):
+        """ GET path below base_url. Returns the decompressed body as bytes.
+            Requests are rate limited, and retried with capped and jittered
+            exponential backoff on throttling, server errors and network
+            errors. Retry-After from the server is honoured.
+            Raises urllib.error.HTTPError for status codes other than 200. """
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            started = self.concurrency.acquire()
+            retry_after = None
+            try:
+                body = self.get_once(path, params)
+                self.concurrency.release(started)
+                return body
+            except urllib.error.HTTPError as e:
+                if e.code not in RETRY_STATUS_CODES:
+                    self.concurrency.release(started)
+                    raise
+                retry_after = parse_retry_after(e.headers.get("Retry-After"))
+                self.concurrency.release(
+                    started, throttled=True, retry_after=retry_after
+                )
+                error = e
+            except (OSError, http.client.HTTPException) as e:
+                # Timeouts and connection errors.
+                self.concurrency.release(started, throttled=True)
+                if self.metrics:
+                    self.metrics.record_error(path, e)
+                error = e
+            except Exception:
+                self.concurrency.release(started)
+                raise
+            #
+            with self.lock:
+                self.stats["throttled"] += 1
+            if attempt >= self.max_retries:
+                raise error
+            attempt += 1
+            with self.lock:
+                self.stats["retries"] += 1
+            # Full jitter, but never shorter than Retry-After.
+            delay = random.uniform(
+                0.0, min(self.backoff_cap, self.backoff_base * 2 ** attempt)
+            )
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            if self.metrics:
+                self.metrics.record_retry(path, error, delay)
+            time.sleep(delay)
+
+    def get_once(self, path, params=None):
+        """ One GET request without retries. """
+        url_path = self.base_path + path
+        if params:
+            url_path += "?" + urllib.parse.urlencode(params)
+        #
+        request_started = time.perf_counter()
+        connection, reused = self.acquire_connection()
+        try:
+            status, headers, body, bytes_received = self.request(
+                connection, url_path
+            )
+        except (http.client.HTTPException, ConnectionError):
+            connection.close()
+            if not reused:
+                raise
+            # The server may have closed an idle keep-alive connection.
+            # Retry once on a new connection.
+            connection, reused = self.acquire_connection(new=True)
+            try:
+                status, headers, body, bytes_received = self.request(
+                    connection, url_path
+                )
+            except Exception:
+                connection.close()
+                raise
+        except Exception:
+            connection.close()
+            raise
+        #
+        if headers.get("Connection", "").lower() == "close":
+            connection.close()
+        else:
+            self.release_connection(connection)
+        #
+        if self.metrics:
+            self.metrics.record_request(
+                path,
+                status,
+                time.perf_counter() - request_started,
+                bytes_received,
+                len(body),
+            )
+        if status != 200:
+            # Same exception as urllib.request.urlopen. The token is removed
+            # from the url since it may end up in logs.
+            reason = http.client.responses.get(status, "")
+            raise urllib.error.HTTPError(
+                self.base_url + path, status, reason, headers, None
+            )
+        return body
+
+    def request(self, connection, url_path):
+        """ Send one request and read the full response from the connection.
+            Returns (status, headers, body, compressed size). """
+        connection.request(
+            "GET",
+            url_path,
+            headers={
+                "Accept": "application/json",
+                "Accept-Encoding": "gzip",
+                "Connection": "keep-alive",
+            },
+        )
+        response = connection.getresponse()
+        # Read in chunks and decompress while reading. The compressed
+        # response is never held in memory as a whole.
+        decompressor = None
+        if response.getheader("Content-Encoding", "").lower() == "gzip":
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        bytes_received = 0
+        chunks = []
+        while True:
+            chunk = response.read(65536)
+            if not chunk:
+                break
+            bytes_received += len(chunk)
+            if decompressor:
+                chunk = decompressor.decompress(chunk)
+            chunks.append(chunk)
+        if decompressor:
+            chunks.append(decompressor.flush())
+        body = b"".join(chunks)
+        #
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes_received"] += bytes_received
+            self.stats["bytes_decoded"] += len(body)
+        return response.status, response.headers, body, bytes_received
+
+    def acquire_connection(self, new=False):
+        """ Returns (connection, reused). """
+        key = (self.scheme, self.host, self.port)
+        with self.lock:
+            idle_list = self.idle_connections.get(key, [])
+            if idle_list and not new:
+                self.stats["connections_reused"] += 1
+                return idle_list.pop(), True
+            self.stats["connections_opened"] += 1
+        #
+        if self.scheme == "https":
+            connection = http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout
+            )
+        else:
+            connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout
+            )
+        return connection, False
+
+    def release_connection(self, connection):
+        """ Return connection to the pool of idle connections. """
+        key = (self.scheme, self.host, self.port)
+        with self.lock:
+            idle_list = self.idle_connections.setdefault(key, [])
+            if len(idle_list) < self.max_idle_connections:
+                idle_list.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        """ Close all idle connections. """
+        with self.lock:
+            idle_connections = self.idle_connections
+            self.idle_connections = {}
+        for idle_list in idle_connections.values():
+            for connection in idle_list:
+                connection.close()
+
+
+class TokenBucket(object):
+    """ Rate limiter shared between threads. Allows bursts of up to burst
+        requests, and rate requests per second on average. No limit is used
+        if rate is None. """
+
+    def __init__(self, rate=None, burst=None):
+        """ """
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Wait until a request is allowed. """
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            # Tokens may be negative. Each caller reserves a token and
+            # waits until it is available.
+            self.tokens -= 1.0
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class AimdController(object):
+    """ Adaptive limit for the number of requests in flight, with additive
+        increase and multiplicative decrease (AIMD). The limit increases by
+        one for each window of successful requests, and is multiplied by
+        decrease when the server throttles or fails. All requests are paused
+        while a Retry-After time is active. """
+
+    def __init__(self, max_limit, min_limit=1, initial_limit=None, decrease=0.5):
+        """ """
+        self.max_limit = max(max_limit, 1)
+        self.min_limit = min(min_limit, self.max_limit)
+        if initial_limit is None:
+            initial_limit = max(self.min_limit, (self.max_limit + 1) // 2)
+        self.limit = float(initial_limit)
+        self.decrease = decrease
+        #
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+
+    def get_limit(self):
+        """ """
+        with self.condition:
+            return int(self.limit)
+
+    def acquire(self):
+        """ Wait for a free slot. Returns the start time, used in release(). """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    self.condition.wait(self.paused_until - now)
+                elif self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return now
+                else:
+                    self.condition.wait()
+
+    def release(self, started, throttled=False, retry_after=None):
+        """ """
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                # Requests started before the last decrease were sent with the
+                # old limit. Only decrease once for them.
+                if started >= self.last_decrease:
+                    self.limit = max(self.min_limit, self.limit * self.decrease)
+                    self.last_decrease = now
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+
+def parse_retry_after(value):
+    """ Retry-After is seconds or a HTTP date. Returns seconds or None. """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_time = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_time is None:
+        return None
+    return max(0.0, retry_time.timestamp() - time.time())
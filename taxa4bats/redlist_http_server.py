@@ -0,0 +1,22 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import http.server
+
+
+class KeepAliveRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ Base class for request handlers with keep-alive connections and
+        without logging for each request. Used by redlist_service and
+        redlist_mock_api. """
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are sent in separate writes. Without TCP_NODELAY the
+    # body can wait for a delayed ACK, about 40 ms, on keep-alive connections.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        """ No logging for each request. """
+        pass
@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+# Species info columns used by the index.
+INDEX_COLUMNS = ["taxonid", "category", "family"]
+
+
+class RedlistIndex(object):
+    """ Lookup tables for species info and the species by country list.
+        All taxonids are stored as strings, since they are integers when
+        read from the API and strings when read from the saved files. """
+
+    def __init__(self, chiroptera_info_dict=None, chiroptera_by_country_list=None):
+        """ """
+        self.species_by_taxonid = {}
+        self.countries_by_taxonid = {}
+        self.taxa_by_country = {}
+        self.taxa_by_category = {}
+        self.taxa_by_family = {}
+        #
+        self.build(chiroptera_info_dict or {}, chiroptera_by_country_list or [])
+
+    def build(self, chiroptera_info_dict, chiroptera_by_country_list):
+        """ One pass over each data set. """
+        for species_dict in chiroptera_info_dict.values():
+            taxonid = str(species_dict.get("taxonid", ""))
+            self.species_by_taxonid[taxonid] = species_dict
+            category = str(species_dict.get("category", ""))
+            self.taxa_by_category.setdefault(category, []).append(taxonid)
+            family = str(species_dict.get("family", "")).upper()
+            self.taxa_by_family.setdefault(family, []).append(taxonid)
+        #
+        for row in chiroptera_by_country_list:
+            country_isocode = row[0]
+            taxonid = str(row[1])
+            self.countries_by_taxonid.setdefault(taxonid, []).append(country_isocode)
+            self.taxa_by_country.setdefault(country_isocode, []).append(taxonid)
+        for country_list in self.countries_by_taxonid.values():
+            country_list.sort()
+
+    def get_species(self, taxonid):
+        """ Returns the species_dict for taxonid, or None. """
+        return self.species_by_taxonid.get(str(taxonid))
+
+    def get_countries(self, taxonid):
+        """ Returns a sorted list of country isocodes for taxonid. """
+        return self.countries_by_taxonid.get(str(taxonid), [])
+
+    def get_taxa_by_country(self, country_isocode):
+        """ """
+        return self.taxa_by_country.get(country_isocode, [])
+
+    def get_taxa_by_category(self, category):
+        """ """
+        return self.taxa_by_category.get(category, [])
+
+    def get_taxa_by_family(self, family):
+        """ """
+        return self.taxa_by_family.get(family.upper(), [])
+
+    def query(self, country=None, category=None, family=None):
+        """ Returns taxonids matching all given filters. The smallest
+            matching list is used as the start, and the others are
+            used as sets. """
+        candidates = []
+        if country is not None:
+            candidates.append(self.get_taxa_by_country(country))
+        if category is not None:
+            candidates.append(self.get_taxa_by_category(category))
+        if family is not None:
+            candidates.append(self.get_taxa_by_family(family))
+        if not candidates:
+            return list(self.species_by_taxonid.keys())
+        #
+        candidates.sort(key=len)
+        filter_sets = [set(taxonids) for taxonids in candidates[1:]]
+        return [
+            taxonid
+            for taxonid in candidates[0]
+            if all(taxonid in filter_set for filter_set in filter_sets)
+        ]
@@ -0,0 +1,342 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import json
+import time
+import bisect
+import pathlib
+import functools
+import threading
+import contextlib
+
+# Upper limits in seconds for the latency histogram buckets. The last
+# bucket, for slower requests, has no upper limit.
+LATENCY_BUCKETS = [
+    0.001,
+    0.002,
+    0.005,
+    0.01,
+    0.02,
+    0.05,
+    0.1,
+    0.2,
+    0.5,
+    1.0,
+    2.0,
+    5.0,
+    10.0,
+]
+
+
+class Metrics(object):
+    """ Counters and timings for IucnRedlist and HttpClient.
+        - Per endpoint: requests, errors, retries, cache hits, bytes received
+          and decoded, a latency histogram and JSON decode time.
+        - Per phase: wall time for each get_all_from_api stage, save_all,
+          load_all and create_excel.
+        Events are sent to callbacks as callback(event, data), where data
+        is a dict. Callbacks may be called from worker threads.
+        Instrumentation is disabled by not using a Metrics object. The
+        instrumented code checks "if self.metrics:" before any call, so
+        the hot loops only pay for one attribute test when disabled.
+        Example:
+            metrics = Metrics(report_filepath="redlist_metrics.json")
+            metrics.add_callback(lambda event, data: print(event, data))
+            redlist = IucnRedlist(api_token=token, metrics=metrics)
+    """
+
+    def __init__(self, callbacks=None, report_filepath=None):
+        """ """
+        self.callbacks = list(callbacks or [])
+        self.report_filepath = report_filepath
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """ """
+        with self.lock:
+            self.started = time.time()
+            # Endpoint: dict with counters.
+            self.endpoints = {}
+            # Dicts with name, taxon_name and seconds, in completed order.
+            self.phases = []
+
+    def add_callback(self, callback):
+        """ """
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        """ """
+        self.callbacks.remove(callback)
+
+    def emit(self, event, **data):
+        """ Send an event to all callbacks. """
+        for callback in self.callbacks:
+            callback(event, data)
+
+    def get_endpoint_stats(self, path):
+        """ Counters for the endpoint of a path. Call with the lock held. """
+        endpoint = get_endpoint(path)
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = {
+                "requests": 0,
+                "errors": 0,
+                "retries": 0,
+                "cache_hits": 0,
+                "bytes_received": 0,
+                "bytes_decoded": 0,
+                "seconds": 0.0,
+                "max_seconds": 0.0,
+                "histogram": [0] * (len(LATENCY_BUCKETS) + 1),
+                "json_decoded": 0,
+                "json_seconds": 0.0,
+            }
+            self.endpoints[endpoint] = stats
+        return stats
+
+    def record_request(self, path, status, seconds, bytes_received, bytes_decoded):
+        """ One HTTP response, also for error status codes. """
+        with self.lock:
+            stats = self.get_endpoint_stats(path)
+            stats["requests"] += 1
+            if status != 200:
+                stats["errors"] += 1
+            stats["bytes_received"] += bytes_received
+            stats["bytes_decoded"] += bytes_decoded
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["histogram"][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        if self.callbacks:
+            self.emit(
+                "request",
+                endpoint=get_endpoint(path),
+                status=status,
+                seconds=seconds,
+                bytes_received=bytes_received,
+                bytes_decoded=bytes_decoded,
+            )
+
+    def record_error(self, path, error):
+        """ A request without response, for example a timeout. """
+        with self.lock:
+            self.get_endpoint_stats(path)["errors"] += 1
+        if self.callbacks:
+            self.emit("error", endpoint=get_endpoint(path), error=str(error))
+
+    def record_retry(self, path, error, delay):
+        """ A failed request that will be made again after delay seconds. """
+        with self.lock:
+            self.get_endpoint_stats(path)["retries"] += 1
+        if self.callbacks:
+            self.emit(
+                "retry", endpoint=get_endpoint(path), error=str(error), delay=delay
+            )
+
+    def record_cache_hit(self, path):
+        """ A response read from the response cache instead of the API. """
+        with self.lock:
+            self.get_endpoint_stats(path)["cache_hits"] += 1
+
+    def record_decode(self, path, seconds):
+        """ Time to decode one JSON response. """
+        with self.lock:
+            stats = self.get_endpoint_stats(path)
+            stats["json_decoded"] += 1
+            stats["json_seconds"] += seconds
+
+    @contextlib.contextmanager
+    def phase(self, name, taxon_name=""):
+        """ Context manager recording the wall time for a phase. """
+        self.emit("phase_start", name=name, taxon_name=taxon_name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - started, taxon_name)
+
+    def add_phase(self, name, seconds, taxon_name=""):
+        """ """
+        with self.lock:
+            self.phases.append(
+                {"name": name, "taxon_name": taxon_name, "seconds": seconds}
+            )
+        self.emit("phase_end", name=name, taxon_name=taxon_name, seconds=seconds)
+
+    def get_summary(self, extra=None):
+        """ Returns a dict with all counters, that can be saved as JSON.
+            Latency percentiles are the upper limits of the histogram buckets.
+            extra is added as it is, for example counters from HttpClient. """
+        with self.lock:
+            endpoints = {
+                endpoint: dict(stats, histogram=list(stats["histogram"]))
+                for endpoint, stats in self.endpoints.items()
+            }
+            phases = [dict(phase) for phase in self.phases]
+        for stats in endpoints.values():
+            requests = stats["requests"]
+            stats["mean_seconds"] = stats["seconds"] / requests if requests else None
+            for percent in [50, 90, 99]:
+                stats["p" + str(percent) + "_seconds"] = get_bucket_percentile(
+                    stats["histogram"], percent
+                )
+        totals = {}
+        for key in [
+            "requests",
+            "errors",
+            "retries",
+            "cache_hits",
+            "bytes_received",
+            "bytes_decoded",
+            "json_seconds",
+        ]:
+            totals[key] = sum(stats[key] for stats in endpoints.values())
+        return {
+            "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            "elapsed_seconds": time.time() - self.started,
+            "latency_buckets": LATENCY_BUCKETS,
+            "totals": totals,
+            "endpoints": endpoints,
+            "phases": phases,
+            "extra": extra or {},
+        }
+
+    def report(self, extra=None):
+        """ Called at the end of a run. Sends the summary to callbacks as a
+            "report" event, and saves it as JSON if report_filepath is used.
+            Returns the summary. """
+        summary = self.get_summary(extra)
+        if self.report_filepath:
+            filepath = pathlib.Path(self.report_filepath)
+            tmp_path = filepath.with_name(filepath.name + ".tmp")
+            with tmp_path.open("w") as file:
+                json.dump(summary, file, indent=1)
+            tmp_path.replace(filepath)
+        self.emit("report", summary=summary)
+        return summary
+
+
+def timed_phase(name):
+    """ Decorator for IucnRedlist methods. Records the wall time for each call
+        as a phase if the object has metrics. """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.metrics:
+                return method(self, *args, **kwargs)
+            with self.metrics.phase(name, self.taxon_name):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def get_endpoint(path):
+    """ The first two parts of a path, without ids and query.
+        Example: /species/id/12345 gives /species/id. """
+    parts = path.split("?")[0].strip("/").split("/")
+    return "/" + "/".join(parts[0:2])
+
+
+def get_bucket_percentile(histogram, percent):
+    """ Upper limit of the bucket with the nearest-rank percentile. None
+        if there are no values, or if it is in the last bucket. """
+    count = sum(histogram)
+    if count == 0:
+        return None
+    rank = max(1, -(-percent * count // 100))
+    accumulated = 0
+    for bucket, bucket_count in enumerate(histogram):
+        accumulated += bucket_count
+        if accumulated >= rank:
+            break
+    if bucket < len(LATENCY_BUCKETS):
+        return LATENCY_BUCKETS[bucket]
+    return None
+
+
+def format_report(summary):
+    """ Text report for a summary from Metrics.get_summary. """
+    lines = []
+    for phase in summary["phases"]:
+        name = phase["name"]
+        if phase["taxon_name"]:
+            name += " (" + phase["taxon_name"] + ")"
+        lines.append("Phase: " + name.ljust(40) + "{:9.3f} s".format(phase["seconds"]))
+    for endpoint, stats in sorted(summary["endpoints"].items()):
+        line = (
+            "Endpoint: "
+            + endpoint.ljust(22)
+            + "requests: "
+            + str(stats["requests"])
+            + "   errors: "
+            + str(stats["errors"])
+            + "   retries: "
+            + str(stats["retries"])
+            + "   cache hits: "
+            + str(stats["cache_hits"])
+            + "   kB received/decoded: "
+            + str(stats["bytes_received"] // 1024)
+            + "/"
+            + str(stats["bytes_decoded"] // 1024)
+        )
+        if stats["requests"]:
+            line += "   mean/max: {:.1f}/{:.1f} ms".format(
+                stats["mean_seconds"] * 1000, stats["max_seconds"] * 1000
+            )
+            line += "   p50/p99: " + "/".join(
+                "{:.0f}".format(stats[key] * 1000) if stats[key] is not None else ">"
+                for key in ["p50_seconds", "p99_seconds"]
+            )
+            line += " ms"
+        line += "   JSON decode: {:.3f} s".format(stats["json_seconds"])
+        lines.append(line)
+    totals = summary["totals"]
+    lines.append(
+        "Total: requests: "
+        + str(totals["requests"])
+        + "   errors: "
+        + str(totals["errors"])
+        + "   retries: "
+        + str(totals["retries"])
+        + "   cache hits: "
+        + str(totals["cache_hits"])
+        + "   bytes received/decoded: "
+        + str(totals["bytes_received"])
+        + "/"
+        + str(totals["bytes_decoded"])
+        + "   JSON decode: {:.3f} s".format(totals["json_seconds"])
+    )
+    for key, value in summary["extra"].items():
+        lines.append(str(key) + ": " + json.dumps(value))
+    return "\n".join(lines)
+
+
+def print_event(event, data):
+    """ Callback printing events as debug lines. Used by IucnRedlist when
+        debug=True. Request events are not printed, see the report. """
+    if event in ["request", "error", "retry", "phase_start"]:
+        return
+    if event == "report":
+        print("DEBUG: Report:\n" + format_report(data["summary"]))
+        return
+    if event == "phase_end":
+        print(
+            "DEBUG: Phase: "
+            + data["name"]
+            + " ("
+            + data["taxon_name"]
+            + ")   {:.3f} s".format(data["seconds"])
+        )
+        return
+    print(
+        "DEBUG: "
+        + event
+        + ": "
+        + "   ".join(str(key) + ": " + str(value) for key, value in data.items())
+    )
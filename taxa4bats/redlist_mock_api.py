@@ -0,0 +1,405 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import gzip
+import json
+import time
+import random
+import threading
+import collections
+import urllib.parse
+import http.server
+
+import redlist_http_server
+import redlist_metrics
+
+# Taxa at scale 1. The real species list has more than 100 000 taxa, and
+# about 1400 of them are bats. Other taxa are fewer here, to keep the
+# scale 1 catalogue small, but still dominate the species list.
+BAT_COUNT = 1400
+OTHER_COUNT = 10600
+COUNTRY_COUNT = 250
+
+BAT_FAMILIES = [
+    "VESPERTILIONIDAE",
+    "PHYLLOSTOMIDAE",
+    "PTEROPODIDAE",
+    "MOLOSSIDAE",
+    "HIPPOSIDERIDAE",
+    "RHINOLOPHIDAE",
+    "EMBALLONURIDAE",
+    "MINIOPTERIDAE",
+    "NYCTERIDAE",
+    "NATALIDAE",
+    "MORMOOPIDAE",
+    "MEGADERMATIDAE",
+    "RHINOPOMATIDAE",
+    "THYROPTERIDAE",
+    "MYSTACINIDAE",
+    "NOCTILIONIDAE",
+    "FURIPTERIDAE",
+    "MYZOPODIDAE",
+    "CRASEONYCTERIDAE",
+    "CISTUGIDAE",
+]
+# (kingdom, phylum, class, order) for bats and other taxa.
+BAT_TAXON = ("ANIMALIA", "CHORDATA", "MAMMALIA", "CHIROPTERA")
+OTHER_TAXA = [
+    ("ANIMALIA", "CHORDATA", "MAMMALIA", "RODENTIA"),
+    ("ANIMALIA", "CHORDATA", "MAMMALIA", "PRIMATES"),
+    ("ANIMALIA", "CHORDATA", "MAMMALIA", "CARNIVORA"),
+    ("ANIMALIA", "CHORDATA", "AVES", "PASSERIFORMES"),
+    ("ANIMALIA", "CHORDATA", "AMPHIBIA", "ANURA"),
+    ("ANIMALIA", "CHORDATA", "REPTILIA", "SQUAMATA"),
+    ("ANIMALIA", "ARTHROPODA", "INSECTA", "ODONATA"),
+    ("PLANTAE", "TRACHEOPHYTA", "MAGNOLIOPSIDA", "FABALES"),
+]
+# Category and weight, roughly as for mammals.
+CATEGORY_WEIGHTS = [
+    ("LC", 55),
+    ("DD", 15),
+    ("NT", 9),
+    ("VU", 9),
+    ("EN", 7),
+    ("CR", 4),
+    ("EX", 1),
+]
+SYLLABLES = (
+    "my o tis pi pis trel lus rhi no lo phus da ben to ni nyc ta ep te ser "
+    "ot ple co bar bas tel la mu ri na ka vou hip po si de ros ar ti beus ca "
+    "rol glos so"
+).split()
+
+
+class MockCatalogue(object):
+    """ Synthetic species list for the mock API. Taxa are created from
+        their position in the list when requested, so large catalogues use
+        little memory. The same scale and seed always give the same data.
+        Scale 1 has 1400 bats among 12 000 taxa in 250 countries. """
+
+    def __init__(self, scale=1, seed=1, version="2019-3", page_size=10000):
+        """ """
+        self.scale = scale
+        self.seed = seed
+        self.version = version
+        self.page_size = page_size
+        self.bat_count = int(BAT_COUNT * scale)
+        self.taxon_count = self.bat_count + int(OTHER_COUNT * scale)
+        # Every stride:th taxon is a bat, to spread them over the pages.
+        self.bat_stride = max(1, self.taxon_count // max(self.bat_count, 1))
+        self.countries = [
+            (first + second, "Country " + first + second)
+            for first in "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+            for second in "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+        ][0:COUNTRY_COUNT]
+        self.country_positions = {
+            isocode: position for position, (isocode, _) in enumerate(self.countries)
+        }
+        self.category_table = []
+        for category, weight in CATEGORY_WEIGHTS:
+            self.category_table += [category] * weight
+        # Country isocode: taxon positions. Created on first use.
+        self.taxa_by_country = None
+        self.lock = threading.Lock()
+
+    def mix(self, position, salt):
+        """ Deterministic pseudo random integer for a position. """
+        value = (position * 2654435761 + salt * 40503 + self.seed * 97) & 0xFFFFFFFF
+        value ^= value >> 15
+        value = (value * 2246822519) & 0xFFFFFFFF
+        value ^= value >> 13
+        return value
+
+    def is_bat(self, position):
+        """ """
+        return (position % self.bat_stride == 0) and (
+            position // self.bat_stride < self.bat_count
+        )
+
+    def get_taxonid(self, position):
+        """ """
+        return 1000 + position * 3
+
+    def get_position(self, taxonid):
+        """ Returns the position for a taxonid, or None. """
+        position, rest = divmod(int(taxonid) - 1000, 3)
+        if rest or (position < 0) or (position >= self.taxon_count):
+            return None
+        return position
+
+    def get_word(self, number, syllable_count):
+        """ """
+        word = ""
+        for _ in range(syllable_count):
+            number, syllable = divmod(number, len(SYLLABLES))
+            word += SYLLABLES[syllable]
+        return word
+
+    def get_page_row(self, position):
+        """ One row in the species list. """
+        if self.is_bat(position):
+            kingdom, phylum, class_name, order = BAT_TAXON
+            bat_number = position // self.bat_stride
+            genus_number = bat_number // 8
+            family = BAT_FAMILIES[self.mix(genus_number, 1) % len(BAT_FAMILIES)]
+        else:
+            kingdom, phylum, class_name, order = OTHER_TAXA[
+                self.mix(position, 2) % len(OTHER_TAXA)
+            ]
+            genus_number = position // 8
+            family = order[0:5] + "IDAE"
+        genus = self.get_word(self.mix(genus_number, 3), 3).capitalize()
+        epithet = self.get_word(self.mix(position, 4), 3 + self.mix(position, 5) % 2)
+        return {
+            "taxonid": self.get_taxonid(position),
+            "kingdom_name": kingdom,
+            "phylum_name": phylum,
+            "class_name": class_name,
+            "order_name": order,
+            "family_name": family,
+            "genus_name": genus,
+            "scientific_name": genus + " " + epithet,
+            "taxonomic_authority": self.get_word(self.mix(position, 6), 2).capitalize()
+            + ", "
+            + str(1758 + self.mix(position, 7) % 260),
+            "infra_rank": None,
+            "infra_name": None,
+            "population": None,
+            "category": self.category_table[
+                self.mix(position, 8) % len(self.category_table)
+            ],
+            "main_common_name": self.get_word(self.mix(position, 9), 2).capitalize()
+            + " "
+            + ("Bat" if order == "CHIROPTERA" else "Animal"),
+        }
+
+    def get_species_info(self, position):
+        """ Species info, as from species/id. """
+        row = self.get_page_row(position)
+        elevation_upper = 500 + self.mix(position, 10) % 3000
+        elevation_lower = None
+        if self.mix(position, 17) % 2:
+            elevation_lower = elevation_upper // 4
+        return {
+            "taxonid": row["taxonid"],
+            "scientific_name": row["scientific_name"],
+            "kingdom": row["kingdom_name"],
+            "phylum": row["phylum_name"],
+            "class": row["class_name"],
+            "order": row["order_name"],
+            "family": row["family_name"],
+            "genus": row["genus_name"],
+            "main_common_name": row["main_common_name"],
+            "authority": row["taxonomic_authority"],
+            "published_year": 2008 + self.mix(position, 11) % 12,
+            "category": row["category"],
+            "criteria": "B1ab(iii)" if row["category"] in ["VU", "EN", "CR"] else None,
+            "marine_system": False,
+            "freshwater_system": False,
+            "terrestrial_system": True,
+            "aoo_km2": None,
+            "eoo_km2": str(1000 + self.mix(position, 12) % 5000000),
+            "elevation_upper": elevation_upper,
+            "elevation_lower": elevation_lower,
+            "depth_upper": None,
+            "depth_lower": None,
+            "assessor": self.get_word(self.mix(position, 13), 2).capitalize(),
+            "reviewer": self.get_word(self.mix(position, 14), 2).capitalize(),
+            "errata_flag": None,
+            "errata_reason": None,
+            "amended_flag": None,
+            "amended_reason": None,
+        }
+
+    def get_country_positions(self, position):
+        """ Countries for one taxon, as positions in the country list.
+            One to nine countries, five on average. """
+        country_count = 1 + self.mix(position, 15) % 9
+        first = self.mix(position, 16) % len(self.countries)
+        return sorted(
+            (first + step * 17) % len(self.countries) for step in range(country_count)
+        )
+
+    def get_taxa_by_country(self, isocode):
+        """ Taxon positions for one country. """
+        with self.lock:
+            if self.taxa_by_country is None:
+                taxa_by_country = collections.defaultdict(list)
+                for position in range(self.taxon_count):
+                    for country_position in self.get_country_positions(position):
+                        taxa_by_country[country_position].append(position)
+                self.taxa_by_country = taxa_by_country
+        country_position = self.country_positions.get(isocode)
+        return self.taxa_by_country.get(country_position, [])
+
+    def respond(self, path):
+        """ Returns (status, content) for a v3 API path. """
+        parts = [part for part in path.split("/") if part]
+        if parts[0:2] == ["api", "v3"]:
+            parts = parts[2:]
+        if parts == ["version"]:
+            return 200, {"version": self.version}
+        if (len(parts) == 3) and (parts[0:2] == ["species", "page"]):
+            page_number = int(parts[2])
+            first = page_number * self.page_size
+            last = min(first + self.page_size, self.taxon_count)
+            rows = [self.get_page_row(position) for position in range(first, last)]
+            return 200, {"count": len(rows), "page": str(page_number), "result": rows}
+        if (len(parts) == 3) and (parts[0:2] == ["species", "id"]):
+            position = self.get_position(parts[2])
+            result = [] if position is None else [self.get_species_info(position)]
+            return 200, {"name": parts[2], "result": result}
+        if (len(parts) == 4) and (parts[0:3] == ["species", "countries", "id"]):
+            position = self.get_position(parts[3])
+            result = []
+            if position is not None:
+                for country_position in self.get_country_positions(position):
+                    isocode, country = self.countries[country_position]
+                    result.append(
+                        {
+                            "code": isocode,
+                            "country": country,
+                            "presence": "Extant",
+                            "origin": "Native",
+                            "distribution_code": "Native",
+                        }
+                    )
+            return (
+                200,
+                {"count": len(result), "species_id": parts[3], "result": result},
+            )
+        if parts == ["country", "list"]:
+            results = [
+                {"isocode": isocode, "country": country}
+                for isocode, country in self.countries
+            ]
+            return 200, {"count": len(results), "results": results}
+        if (len(parts) == 3) and (parts[0:2] == ["country", "getspecies"]):
+            isocode = parts[2].upper()
+            result = []
+            for position in self.get_taxa_by_country(isocode):
+                row = self.get_page_row(position)
+                result.append(
+                    {
+                        "taxonid": row["taxonid"],
+                        "scientific_name": row["scientific_name"],
+                        "subspecies": None,
+                        "rank": None,
+                        "subpopulation": None,
+                        "category": row["category"],
+                    }
+                )
+            return 200, {"count": len(result), "country": isocode, "result": result}
+        return 404, {"message": "Not found"}
+
+
+class MockIucnApi(object):
+    """ Local HTTP server with the v3 endpoints used by IucnRedlist:
+        version, species/page, species/id, species/countries/id, country/list
+        and country/getspecies. Tokens are not checked.
+        latency: seconds added to each response, with +-50% jitter.
+        error_rate: part of the requests answered with 500.
+        throttle_rate: part of the requests answered with 429 and Retry-After.
+        Example:
+            api = MockIucnApi(MockCatalogue(scale=10), latency=0.02)
+            redlist = IucnRedlist(api_token="test", api_url=api.start())
+    """
+
+    def __init__(
+        self,
+        catalogue=None,
+        latency=0.0,
+        error_rate=0.0,
+        throttle_rate=0.0,
+        seed=1,
+        host="127.0.0.1",
+        port=0,
+    ):
+        """ """
+        self.catalogue = catalogue or MockCatalogue()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.host = host
+        self.port = port
+        #
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.server = None
+        self.clear_stats()
+
+    def clear_stats(self):
+        """ """
+        with self.lock:
+            self.stats = collections.Counter()
+
+    def get_stats(self):
+        """ Counters for requests per endpoint, errors and throttled. """
+        with self.lock:
+            return dict(self.stats)
+
+    def handle(self, path, accept_gzip):
+        """ Returns (status, headers, body). Requests are counted per
+            endpoint pattern, without ids and country codes. """
+        parts = [part for part in urllib.parse.urlsplit(path).path.split("/") if part]
+        if parts[0:2] == ["api", "v3"]:
+            parts = parts[2:]
+        endpoint = redlist_metrics.get_endpoint("/".join(parts))
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats[endpoint] += 1
+            draw = self.random.random()
+            jitter = self.random.uniform(0.5, 1.5)
+        if self.latency:
+            time.sleep(self.latency * jitter)
+        if draw < self.throttle_rate:
+            with self.lock:
+                self.stats["throttled"] += 1
+            return 429, {"Retry-After": "0"}, b"{}"
+        if draw < self.throttle_rate + self.error_rate:
+            with self.lock:
+                self.stats["errors"] += 1
+            return 500, {}, b"{}"
+        status, content = self.catalogue.respond(urllib.parse.urlsplit(path).path)
+        body = json.dumps(content).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if accept_gzip:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        return status, headers, body
+
+    def start(self):
+        """ Serve in a background thread. Returns the API base URL. """
+        self.server = http.server.ThreadingHTTPServer(
+            (self.host, self.port), MockRequestHandler
+        )
+        self.server.daemon_threads = True
+        self.server.api = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        host, port = self.server.server_address[0:2]
+        return "http://" + host + ":" + str(port) + "/api/v3"
+
+    def stop(self):
+        """ """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class MockRequestHandler(redlist_http_server.KeepAliveRequestHandler):
+    """ """
+
+    def do_GET(self):
+        """ """
+        accept_gzip = "gzip" in self.headers.get("Accept-Encoding", "")
+        status, headers, body = self.server.api.handle(self.path, accept_gzip)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
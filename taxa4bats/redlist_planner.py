@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+
+class RequestPlanner(object):
+    """ Selects how to build the species by country list.
+        Strategies:
+        - "country": one country/getspecies request per country. Returns all
+          taxa in the country, also plants, fungi, etc.
+        - "species": one species/countries/id request per taxon in the checklist.
+        Saved rows are never reused, since a taxon may have a changed range
+        without changed summary fields.
+        Cost is estimated as transferred bytes plus a fixed cost per request,
+        for handshakes, headers and server time. """
+
+    def __init__(
+        self,
+        request_cost_bytes=2000,
+        country_response_bytes=250000,
+        species_response_bytes=200,
+        country_row_bytes=120,
+        countries_per_taxon=5.0,
+    ):
+        """ """
+        # Default values are approximate sizes of uncompressed responses.
+        self.request_cost_bytes = request_cost_bytes
+        self.country_response_bytes = country_response_bytes
+        self.species_response_bytes = species_response_bytes
+        self.country_row_bytes = country_row_bytes
+        self.countries_per_taxon = countries_per_taxon
+
+    def estimate(self, strategy, country_count, taxon_count):
+        """ Returns a dict with estimated requests, bytes and cost. """
+        if strategy == "country":
+            requests = country_count
+            byte_count = country_count * self.country_response_bytes
+        elif strategy == "species":
+            requests = taxon_count
+            byte_count = requests * (
+                self.species_response_bytes
+                + self.countries_per_taxon * self.country_row_bytes
+            )
+        else:
+            raise ValueError("Unknown strategy: " + str(strategy))
+        #
+        return {
+            "strategy": strategy,
+            "requests": requests,
+            "bytes": int(byte_count),
+            "cost": int(byte_count + requests * self.request_cost_bytes),
+        }
+
+    def plan(self, country_count, taxon_count):
+        """ Returns the estimate with the lowest cost. """
+        estimates = [
+            self.estimate(strategy, country_count, taxon_count)
+            for strategy in ["country", "species"]
+        ]
+        return min(estimates, key=lambda estimate: estimate["cost"])
+
+    def update_from_rows(self, row_count, taxon_count):
+        """ Use the number of species by country rows in saved files to
+            estimate countries per taxon. """
+        if taxon_count > 0 and row_count > 0:
+            self.countries_per_taxon = row_count / taxon_count
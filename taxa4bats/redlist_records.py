@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import collections.abc
+
+# Columns with numbers. See to_number.
+NUMERIC_COLUMNS = [
+    "taxonid",
+    "published_year",
+    "aoo_km2",
+    "eoo_km2",
+    "elevation_upper",
+    "elevation_lower",
+    "depth_upper",
+    "depth_lower",
+]
+
+
+class SpeciesRecord(collections.abc.Mapping):
+    """ Compact read-only species info, used instead of one dict per species.
+        The values are stored in a tuple, and the column positions in a
+        dict shared by all records from the same file. The slots are private,
+        since a "values" attribute would hide Mapping.values(). """
+
+    __slots__ = ("_columns", "_values")
+
+    def __init__(self, columns, values):
+        """ """
+        self._columns = columns
+        self._values = values
+
+    def __getitem__(self, key):
+        """ """
+        position = self._columns.get(key)
+        if (position is None) or (position >= len(self._values)):
+            raise KeyError(key)
+        return self._values[position]
+
+    def __iter__(self):
+        """ """
+        return iter(list(self._columns)[0 : len(self._values)])
+
+    def __len__(self):
+        """ """
+        return min(len(self._columns), len(self._values))
+
+    def __repr__(self):
+        """ """
+        return "SpeciesRecord(" + repr(dict(self)) + ")"
+
+    def get_number(self, key):
+        """ Value as int or float, or None if empty. See to_number. """
+        return to_number(self.get(key, ""))
+
+
+class RecordBuilder(object):
+    """ Creates SpeciesRecord objects for one header. Values are kept as
+        the same text as in the saved files. Repeated text values, like
+        kingdom, family and category, are stored once and shared between
+        records (dictionary encoding). Numeric columns, mostly unique
+        values, are not shared. """
+
+    def __init__(self, header):
+        """ """
+        self.columns = {item: position for position, item in enumerate(header)}
+        self.shared_columns = [item not in NUMERIC_COLUMNS for item in header]
+        self.shared_text = {"": ""}
+
+    def create(self, parts):
+        """ Returns a SpeciesRecord for the text values in parts. """
+        shared_text = self.shared_text
+        return SpeciesRecord(
+            self.columns,
+            tuple(
+                shared_text.setdefault(part, part) if shared else part
+                for shared, part in zip(self.shared_columns, parts)
+            ),
+        )
+
+
+def to_number(value):
+    """ Returns int or float if the text is written back unchanged by str(),
+        None for empty values and the text in other cases. """
+    if value == "":
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        try:
+            number = float(value)
+        except ValueError:
+            return value
+    if str(number) != value:
+        return value
+    return number
+
+
+def text_value(value):
+    """ Same text format as the files written by save_all. Empty string
+        for None. """
+    value = str(value)
+    if value == "None":
+        value = ""
+    return value
+
+
+def measure_memory(dirpath="data"):
+    """ Returns bytes allocated for species info after load_all, with
+        dicts and with SpeciesRecord objects. Used to compare the two. """
+    import tracemalloc
+    import iucn_redlist
+
+    result = {}
+    for compact in [False, True]:
+        redlist = iucn_redlist.IucnRedlist()
+        tracemalloc.start()
+        redlist.load_info(dirpath, compact=compact)
+        result["records" if compact else "dicts"] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    return result
@@ -0,0 +1,317 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import gzip
+import json
+import heapq
+import pathlib
+import unicodedata
+import collections
+
+# Fields in species info used as names.
+NAME_FIELDS = ["scientific_name", "main_common_name"]
+
+# Match types, best first.
+MATCH_TYPES = ["exact", "prefix", "fuzzy"]
+
+# Max trie depth. Longer prefixes are compared to the keys in the range
+# of the deepest node, which is small at this depth.
+TRIE_DEPTH = 6
+
+
+class SearchIndex(object):
+    """ Name search for autocomplete and typo-tolerant matching of
+        scientific names and common names.
+        - Prefix search uses a trie over the names and over each word in the
+          names. The keys are sorted, and each trie node stores the range
+          of keys starting with the node prefix, so no subtree walk is needed.
+        - Fuzzy search uses a trigram index to find candidates, and edit
+          distance to rank them.
+        Results can be filtered by family, category and country. """
+
+    def __init__(self, info_dict=None, by_country_list=None, version=""):
+        """ """
+        self.version = version
+        # Taxonid as string: [scientific_name, family, category, countries].
+        self.taxa = {}
+        # Normalized name: [[name, field, taxonid], ...].
+        self.names = {}
+        # Sorted (key, normalized name) pairs, and the trie over the keys.
+        self.keys = []
+        self.trie = {}
+        # Trigram: list of normalized names.
+        self.trigrams = {}
+        #
+        if info_dict is not None:
+            self.build(info_dict, by_country_list or [])
+
+    def build(self, info_dict, by_country_list):
+        """ """
+        countries_by_taxonid = {}
+        for row in by_country_list:
+            countries_by_taxonid.setdefault(str(row[1]), set()).add(row[0])
+        for species_dict in info_dict.values():
+            taxonid = str(species_dict.get("taxonid", ""))
+            self.taxa[taxonid] = [
+                str(species_dict.get("scientific_name", "")),
+                str(species_dict.get("family", "")).upper(),
+                str(species_dict.get("category", "")),
+                sorted(countries_by_taxonid.get(taxonid, [])),
+            ]
+            for field in NAME_FIELDS:
+                name = species_dict.get(field)
+                if name:
+                    name = str(name)
+                    self.names.setdefault(normalize(name), []).append(
+                        [name, field, taxonid]
+                    )
+        # The full name and each word start are used as keys.
+        keys = set()
+        for normalized in self.names:
+            words = normalized.split(" ")
+            for position in range(len(words)):
+                keys.add((" ".join(words[position:]), normalized))
+        self.keys = sorted(keys)
+        self.build_trie()
+        #
+        for normalized in self.names:
+            for trigram in set(get_trigrams(normalized)):
+                self.trigrams.setdefault(trigram, []).append(normalized)
+
+    def build_trie(self):
+        """ Nodes are dicts with one item per next character, and the item
+            "" with [first, last] positions in the sorted keys. """
+        self.trie = {}
+        for position, (key, _) in enumerate(self.keys):
+            node = self.trie
+            for character in key[0:TRIE_DEPTH]:
+                node = node.setdefault(character, {})
+                key_range = node.setdefault("", [position, position + 1])
+                key_range[1] = position + 1
+
+    def complete(self, prefix, limit=10, family=None, category=None, country=None):
+        """ Autocomplete. Returns matches for names or words in names
+            starting with prefix. """
+        return self.search(
+            prefix,
+            limit=limit,
+            family=family,
+            category=category,
+            country=country,
+            fuzzy=False,
+        )
+
+    def search(
+        self,
+        text,
+        limit=10,
+        family=None,
+        category=None,
+        country=None,
+        fuzzy=True,
+        max_distance=None,
+    ):
+        """ Returns a ranked list of dicts with taxonid, scientific_name,
+            name, field, match and distance. Exact and prefix matches are
+            ranked before fuzzy matches. Fuzzy matches are only searched for
+            if the text is not a name and there are less than limit other
+            matches. """
+        normalized_text = normalize(text)
+        if not normalized_text:
+            return []
+        filters = (family.upper() if family else None, category, country)
+        # Normalized name: (match type, distance).
+        matches = {}
+        exact = normalized_text in self.names
+        if exact:
+            matches[normalized_text] = ("exact", 0)
+        for normalized in self.get_prefix_matches(normalized_text):
+            matches.setdefault(normalized, ("prefix", 0))
+        results = self.get_results(matches, filters, limit)
+        if fuzzy and (not exact) and (len(results) < limit):
+            if max_distance is None:
+                max_distance = max(1, min(2, len(normalized_text) // 5))
+            # The limit is only known to hold without filters.
+            fuzzy_limit = None
+            if filters == (None, None, None):
+                fuzzy_limit = limit
+            for normalized, distance in self.get_fuzzy_matches(
+                normalized_text, max_distance, fuzzy_limit
+            ):
+                if normalized not in matches:
+                    matches[normalized] = ("fuzzy", distance)
+            results = self.get_results(matches, filters, limit)
+        return results
+
+    def get_prefix_matches(self, prefix):
+        """ Normalized names with the prefix at a word start. """
+        node = self.trie
+        for character in prefix[0:TRIE_DEPTH]:
+            node = node.get(character)
+            if node is None:
+                return []
+        first, last = node[""]
+        return [
+            normalized
+            for key, normalized in self.keys[first:last]
+            if key.startswith(prefix)
+        ]
+
+    def get_fuzzy_matches(self, text, max_distance, limit=None):
+        """ Returns (normalized name, distance) for names within max_distance
+            edits. Each edit changes at most 3 trigrams, so names sharing
+            fewer trigrams are not compared. Candidates sharing most trigrams
+            are compared first. If limit is given, max_distance is lowered
+            when limit names are found, since names with a larger distance
+            will not be used. """
+        trigrams = set(get_trigrams(text))
+        if len(trigrams) <= 3 * max_distance:
+            # Short text. All names are candidates.
+            candidates = [(normalized, 0) for normalized in self.names]
+        else:
+            shared = collections.Counter()
+            for trigram in trigrams:
+                shared.update(self.trigrams.get(trigram, []))
+            candidates = shared.most_common()
+        matches = []
+        distances = []
+        for normalized, count in candidates:
+            if count and (count < len(trigrams) - 3 * max_distance):
+                break
+            if abs(len(normalized) - len(text)) > max_distance:
+                continue
+            distance = edit_distance(text, normalized, max_distance)
+            if distance <= max_distance:
+                matches.append((normalized, distance))
+                if limit:
+                    distances.append(distance)
+                    if len(distances) >= limit:
+                        distances.sort()
+                        del distances[limit:]
+                        max_distance = distances[-1]
+        return matches
+
+    def get_results(self, matches, filters, limit):
+        """ Filtered results for matched names. Returns the limit best
+            ranked results. """
+        family, category, country = filters
+        ranked = []
+        for normalized, (match, distance) in matches.items():
+            for name, field, taxonid in self.names[normalized]:
+                taxon = self.taxa.get(taxonid)
+                if taxon is None:
+                    continue
+                scientific_name, taxon_family, taxon_category, countries = taxon
+                if (family is not None) and (taxon_family != family):
+                    continue
+                if (category is not None) and (taxon_category != category):
+                    continue
+                if (country is not None) and (country not in countries):
+                    continue
+                ranked.append(
+                    (
+                        MATCH_TYPES.index(match),
+                        distance,
+                        NAME_FIELDS.index(field),
+                        len(name),
+                        name,
+                        taxonid,
+                    )
+                )
+        results = []
+        for match_index, distance, field_index, _, name, taxonid in heapq.nsmallest(
+            limit, ranked
+        ):
+            results.append(
+                {
+                    "taxonid": taxonid,
+                    "scientific_name": self.taxa[taxonid][0],
+                    "name": name,
+                    "field": NAME_FIELDS[field_index],
+                    "match": MATCH_TYPES[match_index],
+                    "distance": distance,
+                }
+            )
+        return results
+
+    def save(self, filepath):
+        """ Save as gzipped JSON. The trie is built again when loaded. """
+        content = {
+            "version": self.version,
+            "taxa": self.taxa,
+            "names": self.names,
+            "keys": self.keys,
+            "trigrams": self.trigrams,
+        }
+        filepath = pathlib.Path(filepath)
+        tmp_path = filepath.with_name(filepath.name + ".tmp")
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as file:
+            json.dump(content, file, ensure_ascii=False, separators=(",", ":"))
+        tmp_path.replace(filepath)
+
+    @classmethod
+    def load(cls, filepath):
+        """ """
+        with gzip.open(filepath, "rt", encoding="utf-8") as file:
+            content = json.load(file)
+        search_index = cls(version=content["version"])
+        search_index.taxa = content["taxa"]
+        search_index.names = content["names"]
+        search_index.keys = [tuple(key) for key in content["keys"]]
+        search_index.trigrams = content["trigrams"]
+        search_index.build_trie()
+        return search_index
+
+
+def normalize(text):
+    """ Lower case without accents, and single spaces between words. """
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(
+        character for character in text if not unicodedata.combining(character)
+    )
+    return " ".join(text.lower().split())
+
+
+def get_trigrams(text):
+    """ Trigrams with padding, so that the first and last characters are
+        part of three trigrams. """
+    padded = "  " + text + "  "
+    return [padded[position : position + 3] for position in range(len(padded) - 2)]
+
+
+def edit_distance(text_a, text_b, max_distance):
+    """ Levenshtein distance. Only cells within max_distance of the diagonal
+        are calculated, and max_distance + 1 is returned as soon as the
+        distance is known to be larger than max_distance. """
+    if abs(len(text_a) - len(text_b)) > max_distance:
+        return max_distance + 1
+    too_far = max_distance + 1
+    previous_row = [
+        position if position <= max_distance else too_far
+        for position in range(len(text_b) + 1)
+    ]
+    for position_a, character_a in enumerate(text_a, 1):
+        first = max(1, position_a - max_distance)
+        last = min(len(text_b), position_a + max_distance)
+        row = [too_far] * (len(text_b) + 1)
+        if position_a <= max_distance:
+            row[0] = position_a
+        row_min = row[0]
+        for position_b in range(first, last + 1):
+            cost = previous_row[position_b - 1] + (
+                character_a != text_b[position_b - 1]
+            )
+            if previous_row[position_b] + 1 < cost:
+                cost = previous_row[position_b] + 1
+            if row[position_b - 1] + 1 < cost:
+                cost = row[position_b - 1] + 1
+            row[position_b] = cost
+            if cost < row_min:
+                row_min = cost
+        if row_min > max_distance:
+            return too_far
+        previous_row = row
+    return min(previous_row[-1], too_far)
@@ -0,0 +1,359 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import json
+import logging
+import hashlib
+import pathlib
+import threading
+import urllib.parse
+import http.server
+
+import iucn_redlist
+import redlist_http_server
+import redlist_records
+
+# Reload and request errors are logged here, not printed, since the service
+# may run inside another program. Without logging configuration, warnings
+# and errors are written to stderr.
+logger = logging.getLogger(__name__)
+
+
+class RedlistService(object):
+    """ Read-only HTTP service with JSON responses for data saved by
+        save_all. Endpoints:
+        - /version
+        - /species?country=SE&category=EN&family=vespertilionidae
+        - /species/<scientific_name>
+        - /countries
+        - /countries/<isocode>
+        - /categories
+        - /categories/<category>
+        - /search?q=<text>&limit=10
+        Species info values, also taxonid, are returned as text in the same
+        format as the saved files, for all storages. Unexpected errors give
+        a JSON response with status 500.
+        Responses are memoised per path and query, and have an ETag with
+        the Red List version. The data is loaded again when save_all has
+        published new files, which is checked every reload_interval seconds.
+        Example:
+            service = RedlistService("taxa4bats/data", port=8080)
+            service.start()
+    """
+
+    def __init__(
+        self,
+        dirpath="data",
+        storage="tsv",
+        taxon_name="chiroptera",
+        host="127.0.0.1",
+        port=8080,
+        reload_interval=2.0,
+        max_cached_responses=10000,
+    ):
+        """ """
+        self.dirpath = dirpath
+        self.storage = storage
+        self.taxon_name = taxon_name
+        self.host = host
+        self.port = port
+        self.reload_interval = reload_interval
+        self.max_cached_responses = max_cached_responses
+        #
+        self.snapshot = None
+        self.published_mtime = None
+        self.reload_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.server = None
+        self.threads = []
+        #
+        self.reload()
+
+    def get_published_path(self):
+        """ File replaced last by save_all. """
+        if self.storage == "sqlite":
+            return pathlib.Path(self.dirpath, "redlist_" + self.taxon_name + ".sqlite")
+        return pathlib.Path(self.dirpath, "redlist_version.txt")
+
+    def reload(self):
+        """ Load the data if save_all has published new files since last
+            time. Requests are served from the old snapshot until the new
+            one is loaded. Returns True if loaded. """
+        with self.reload_lock:
+            try:
+                published_mtime = self.get_published_path().stat().st_mtime_ns
+            except OSError:
+                return False
+            if published_mtime == self.published_mtime:
+                return False
+            redlist = iucn_redlist.IucnRedlist(taxon_name=self.taxon_name)
+            redlist.load_all(dirpath=self.dirpath, storage=self.storage)
+            self.snapshot = ServiceSnapshot(redlist, self.max_cached_responses)
+            self.published_mtime = published_mtime
+            return True
+
+    def watch(self):
+        """ Runs in a thread until stop(). """
+        while not self.stop_event.wait(self.reload_interval):
+            try:
+                self.reload()
+            except Exception as e:
+                # Files removed or changed during load. Try again later.
+                logger.warning("Reload failed: %s", e)
+
+    def get_response(self, path):
+        """ Returns (status, etag, body) for a request path with query. """
+        return self.snapshot.get_response(path)
+
+    def start(self):
+        """ Serve in background threads. Returns the base URL. """
+        self.server = http.server.ThreadingHTTPServer(
+            (self.host, self.port), RequestHandler
+        )
+        self.server.daemon_threads = True
+        self.server.service = self
+        self.stop_event.clear()
+        self.threads = [
+            threading.Thread(target=self.server.serve_forever, daemon=True),
+            threading.Thread(target=self.watch, daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+        host, port = self.server.server_address[0:2]
+        return "http://" + host + ":" + str(port)
+
+    def serve_forever(self):
+        """ Serve until interrupted. """
+        self.start()
+        try:
+            self.threads[0].join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        """ """
+        self.stop_event.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class ServiceSnapshot(object):
+    """ Responses for one loaded IucnRedlist. """
+
+    def __init__(self, redlist, max_cached_responses=10000):
+        """ """
+        self.redlist = redlist
+        self.version = redlist.get_redlist_version()
+        self.max_cached_responses = max_cached_responses
+        # Path with query: (status, etag, body).
+        self.responses = {}
+        self.lock = threading.Lock()
+        # Build lookup tables before the first request.
+        self.redlist.get_index()
+        self.routes = {
+            "version": self.get_version,
+            "species": self.get_species,
+            "countries": self.get_countries,
+            "categories": self.get_categories,
+            "search": self.search,
+        }
+
+    def get_response(self, path):
+        """ Memoised responses. Unexpected errors give a 500 response, which
+            is not memoised. """
+        with self.lock:
+            response = self.responses.get(path)
+        if response is not None:
+            return response
+        try:
+            response = self.create_response(*self.create_content(path))
+        except Exception:
+            logger.exception("Request failed: %s", path)
+            return self.create_response(500, {"error": "Internal server error."})
+        with self.lock:
+            if len(self.responses) >= self.max_cached_responses:
+                self.responses.clear()
+            self.responses[path] = response
+        return response
+
+    def create_response(self, status, content):
+        """ Returns (status, etag, body). """
+        body = json.dumps(content, ensure_ascii=False).encode("utf-8")
+        etag = (
+            '"' + self.version + "-" + hashlib.sha1(body).hexdigest()[0:16] + '"'
+        )
+        return (status, etag, body)
+
+    def create_content(self, path):
+        """ Returns (status, content). """
+        parsed = urllib.parse.urlsplit(path)
+        parts = [
+            urllib.parse.unquote(part) for part in parsed.path.split("/") if part
+        ]
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        route = self.routes.get(parts[0]) if parts else None
+        if route is None:
+            return 404, {"error": "Not found: " + parsed.path}
+        try:
+            return route(parts[1:], query)
+        except ValueError as e:
+            return 400, {"error": str(e)}
+
+    def get_version(self, parts, query):
+        """ """
+        return (
+            200,
+            {
+                "version": self.version,
+                "citation": self.redlist.get_redlist_citation(),
+            },
+        )
+
+    def get_species(self, parts, query):
+        """ One species with countries, or species matching filters. """
+        if parts:
+            species_dict = self.redlist.get_species_info(parts[0])
+            if species_dict is None:
+                return 404, {"error": "Species not found: " + parts[0]}
+            content = self.get_text_values(species_dict)
+            content["countries"] = self.redlist.get_species_countries(parts[0])
+            return 200, content
+        scientific_names = self.redlist.query_species(
+            country=query.get("country"),
+            category=query.get("category"),
+            family=query.get("family"),
+        )
+        return 200, [self.get_summary(name) for name in scientific_names]
+
+    def get_countries(self, parts, query):
+        """ All countries with number of species, or species in one country. """
+        country_dict = self.redlist.get_country_dict()
+        index = self.redlist.get_index()
+        if parts:
+            isocode = parts[0].upper()
+            if isocode not in country_dict:
+                return 404, {"error": "Country not found: " + parts[0]}
+            scientific_names = self.redlist.query_species(country=isocode)
+            return (
+                200,
+                {
+                    "isocode": isocode,
+                    "country": country_dict[isocode],
+                    "species": [self.get_summary(name) for name in scientific_names],
+                },
+            )
+        return (
+            200,
+            [
+                {
+                    "isocode": isocode,
+                    "country": country_dict[isocode],
+                    "species_count": len(set(index.get_taxa_by_country(isocode))),
+                }
+                for isocode in sorted(country_dict)
+            ],
+        )
+
+    def get_categories(self, parts, query):
+        """ Number of species per category, or species in one category. """
+        index = self.redlist.get_index()
+        if parts:
+            category = parts[0].upper()
+            scientific_names = self.redlist.query_species(category=category)
+            if not scientific_names:
+                return 404, {"error": "Category not found: " + parts[0]}
+            return (
+                200,
+                {
+                    "category": category,
+                    "species": [self.get_summary(name) for name in scientific_names],
+                },
+            )
+        categories = sorted(
+            set(
+                str(species_dict.get("category", ""))
+                for species_dict in self.redlist.get_chiroptera_info_dict().values()
+            )
+        )
+        return (
+            200,
+            {
+                category: len(index.get_taxa_by_category(category))
+                for category in categories
+            },
+        )
+
+    def search(self, parts, query):
+        """ Name search, see redlist_search. """
+        text = query.get("q", "")
+        try:
+            limit = int(query.get("limit", 10))
+        except ValueError:
+            raise ValueError("limit must be an integer.")
+        return (
+            200,
+            self.redlist.search_species(
+                text,
+                limit=limit,
+                family=query.get("family"),
+                category=query.get("category"),
+                country=query.get("country"),
+            ),
+        )
+
+    def get_summary(self, scientific_name):
+        """ """
+        species_dict = self.redlist.get_species_info(scientific_name) or {}
+        summary = {"scientific_name": scientific_name}
+        for item in ["taxonid", "family", "category", "main_common_name"]:
+            summary[item] = redlist_records.text_value(species_dict.get(item, ""))
+        return summary
+
+    def get_text_values(self, species_dict):
+        """ Species info in the text format of the saved files, with all
+            columns. Rows in the text files may be shorter than the header,
+            and values from the API are not text. """
+        return {
+            item: redlist_records.text_value(species_dict.get(item, ""))
+            for item in self.redlist.chiroptera_info_header
+        }
+
+
+class RequestHandler(redlist_http_server.KeepAliveRequestHandler):
+    """ """
+
+    def do_GET(self):
+        """ """
+        status, etag, body = self.server.service.get_response(self.path)
+        if (status == 200) and (etag in self.get_none_match()):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def get_none_match(self):
+        """ ETags in the If-None-Match header. """
+        header = self.headers.get("If-None-Match", "")
+        return [etag.strip() for etag in header.split(",") if etag.strip()]
+
+
+### Main. ###
+if __name__ == "__main__":
+    """ """
+    service = RedlistService(dirpath="taxa4bats/data", port=8080)
+    print("Serving on http://127.0.0.1:8080")
+    service.serve_forever()
@@ -0,0 +1,305 @@
+#!/usr/bin/python3
+# -*- coding:utf-8 -*-
+# Project: http://cloudedbats.org
+# Copyright (c) 2018-present Arnold Andreasson
+# License: MIT License (see LICENSE.txt or http://opensource.org/licenses/mit).
+
+import os
+import pathlib
+import sqlite3
+import threading
+import collections.abc
+
+import redlist_records
+
+INDEX_STATEMENTS = [
+    "CREATE INDEX species_taxonid ON species (taxonid)",
+    "CREATE INDEX species_scientific_name ON species (scientific_name)",
+    "CREATE INDEX species_family ON species (family)",
+    "CREATE INDEX species_category ON species (category)",
+    "CREATE INDEX by_country_country ON by_country (country_isocode)",
+    "CREATE INDEX by_country_taxonid ON by_country (taxonid)",
+]
+
+
+class SqliteStore(object):
+    """ Stores the same data as the text files from save_all in one SQLite
+        file. Values are stored as text, in the same format as the text
+        files. After open() the species and species by country data are
+        read on demand, and lookups are made as indexed queries. The store
+        has the same lookup methods as redlist_index.RedlistIndex. """
+
+    def __init__(self, filepath):
+        """ """
+        self.filepath = pathlib.Path(filepath)
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def save(self, redlist):
+        """ Write all data in one transaction to a new file, and replace the
+            old file when done. """
+        tmp_path = self.filepath.with_name(self.filepath.name + ".tmp")
+        if tmp_path.exists():
+            tmp_path.unlink()
+        info_header = redlist.chiroptera_info_header
+        info_columns = ", ".join('"' + item + '" TEXT' for item in info_header)
+        #
+        checklist_rows = [
+            (position, scientific_name, str(taxonid))
+            for position, (scientific_name, taxonid) in enumerate(
+                redlist.get_chiroptera_checklist().items()
+            )
+        ]
+        info_rows = [
+            [
+                redlist_records.text_value(species_dict.get(item, ""))
+                for item in info_header
+            ]
+            for _, species_dict in sorted(redlist.chiroptera_info_dict.items())
+        ]
+        by_country_rows = [
+            [position] + list(row)
+            for position, row in enumerate(redlist.chiroptera_by_country_list)
+        ]
+        #
+        connection = sqlite3.connect(str(tmp_path))
+        try:
+            with connection:
+                connection.execute("CREATE TABLE meta (key TEXT, value TEXT)")
+                connection.execute(
+                    "CREATE TABLE checklist "
+                    "(position INTEGER, scientific_name TEXT, taxonid TEXT)"
+                )
+                connection.execute("CREATE TABLE species (" + info_columns + ")")
+                connection.execute(
+                    "CREATE TABLE countries (isocode TEXT, country TEXT)"
+                )
+                connection.execute(
+                    "CREATE TABLE by_country (position INTEGER, "
+                    "country_isocode TEXT, taxonid TEXT, "
+                    "scientific_name TEXT, category TEXT)"
+                )
+                #
+                connection.execute(
+                    "INSERT INTO meta VALUES ('version', ?)", (redlist.version,)
+                )
+                connection.executemany(
+                    "INSERT INTO checklist VALUES (?, ?, ?)", checklist_rows
+                )
+                connection.executemany(
+                    "INSERT INTO species VALUES ("
+                    + ", ".join("?" for _ in info_header)
+                    + ")",
+                    info_rows,
+                )
+                connection.executemany(
+                    "INSERT INTO countries VALUES (?, ?)",
+                    sorted(redlist.country_dict.items()),
+                )
+                connection.executemany(
+                    "INSERT INTO by_country VALUES (?, ?, ?, ?, ?)", by_country_rows
+                )
+                # Indexes are created after the inserts, which is faster.
+                for sql in INDEX_STATEMENTS:
+                    connection.execute(sql)
+        finally:
+            connection.close()
+        #
+        self.close()
+        os.replace(tmp_path, self.filepath)
+
+    def open(self):
+        """ """
+        if self.connection is None:
+            # Opened read only. Used from several threads, with a lock.
+            self.connection = sqlite3.connect(
+                self.filepath.resolve().as_uri() + "?mode=ro",
+                uri=True,
+                check_same_thread=False,
+            )
+
+    def close(self):
+        """ """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def execute(self, sql, parameters=()):
+        """ Returns all rows for a query. """
+        self.open()
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def get_version(self):
+        """ """
+        rows = self.execute("SELECT value FROM meta WHERE key = 'version'")
+        return rows[0][0] if rows else ""
+
+    def get_checklist(self):
+        """ Returns a dict with scientific_name: taxonid. """
+        rows = self.execute(
+            "SELECT scientific_name, taxonid FROM checklist ORDER BY position"
+        )
+        return {scientific_name: int(taxonid) for scientific_name, taxonid in rows}
+
+    def get_country_dict(self):
+        """ """
+        return dict(self.execute("SELECT isocode, country FROM countries"))
+
+    def get_info_mapping(self):
+        """ Read-only dict-like species info, keyed by scientific_name. """
+        return SqliteSpeciesMapping(self)
+
+    def get_by_country_rows(self):
+        """ Read-only list-like species by country rows. """
+        return SqliteByCountryRows(self)
+
+    # Same methods as redlist_index.RedlistIndex.
+
+    def get_species(self, taxonid):
+        """ Returns the species_dict for taxonid, or None. """
+        return self.select_species("WHERE taxonid = ?", (str(taxonid),), single=True)
+
+    def get_countries(self, taxonid):
+        """ Returns a sorted list of country isocodes for taxonid. """
+        rows = self.execute(
+            "SELECT country_isocode FROM by_country WHERE taxonid = ? "
+            "ORDER BY country_isocode",
+            (str(taxonid),),
+        )
+        return [row[0] for row in rows]
+
+    def get_taxa_by_country(self, country_isocode):
+        """ """
+        rows = self.execute(
+            "SELECT taxonid FROM by_country WHERE country_isocode = ? "
+            "ORDER BY position",
+            (country_isocode,),
+        )
+        return [row[0] for row in rows]
+
+    def get_taxa_by_category(self, category):
+        """ """
+        rows = self.execute(
+            "SELECT taxonid FROM species WHERE category = ?", (category,)
+        )
+        return [row[0] for row in rows]
+
+    def get_taxa_by_family(self, family):
+        """ """
+        rows = self.execute(
+            "SELECT taxonid FROM species WHERE family = ?", (family.upper(),)
+        )
+        return [row[0] for row in rows]
+
+    def query(self, country=None, category=None, family=None):
+        """ Returns taxonids matching all given filters, as one query. """
+        sql = "SELECT species.taxonid FROM species"
+        conditions = []
+        parameters = []
+        if country is not None:
+            sql += " JOIN by_country ON by_country.taxonid = species.taxonid"
+            conditions.append("by_country.country_isocode = ?")
+            parameters.append(country)
+        if category is not None:
+            conditions.append("species.category = ?")
+            parameters.append(category)
+        if family is not None:
+            conditions.append("species.family = ?")
+            parameters.append(family.upper())
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return [row[0] for row in self.execute(sql, parameters)]
+
+    def select_species(self, where="", parameters=(), single=False):
+        """ """
+        self.open()
+        with self.lock:
+            cursor = self.connection.execute(
+                "SELECT * FROM species " + where, parameters
+            )
+            header = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+        species_list = [dict(zip(header, row)) for row in rows]
+        if single:
+            return species_list[0] if species_list else None
+        return species_list
+
+
+class SqliteSpeciesMapping(collections.abc.Mapping):
+    """ Species info keyed by scientific_name. Rows are read when used. """
+
+    def __init__(self, store):
+        """ """
+        self.store = store
+
+    def __getitem__(self, scientific_name):
+        """ """
+        species_dict = self.store.select_species(
+            "WHERE scientific_name = ?", (scientific_name,), single=True
+        )
+        if species_dict is None:
+            raise KeyError(scientific_name)
+        return species_dict
+
+    def __iter__(self):
+        """ """
+        rows = self.store.execute("SELECT scientific_name FROM species ORDER BY rowid")
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        """ """
+        return self.store.execute("SELECT COUNT(*) FROM species")[0][0]
+
+    def __contains__(self, scientific_name):
+        """ """
+        rows = self.store.execute(
+            "SELECT 1 FROM species WHERE scientific_name = ?", (scientific_name,)
+        )
+        return bool(rows)
+
+    def values(self):
+        """ One query instead of one per species. """
+        return self.store.select_species("ORDER BY rowid")
+
+    def items(self):
+        """ One query instead of one per species. """
+        return [
+            (species_dict["scientific_name"], species_dict)
+            for species_dict in self.values()
+        ]
+
+
+class SqliteByCountryRows(collections.abc.Sequence):
+    """ Species by country rows, in saved order. Rows are read when used. """
+
+    def __init__(self, store):
+        """ """
+        self.store = store
+
+    def __getitem__(self, index):
+        """ """
+        if isinstance(index, slice):
+            return list(self)[index]
+        if index < 0:
+            index += len(self)
+        rows = self.store.execute(
+            "SELECT country_isocode, taxonid, scientific_name, category "
+            "FROM by_country WHERE position = ?",
+            (index,),
+        )
+        if not rows:
+            raise IndexError(index)
+        return rows[0]
+
+    def __iter__(self):
+        """ """
+        rows = self.store.execute(
+            "SELECT country_isocode, taxonid, scientific_name, category "
+            "FROM by_country ORDER BY position"
+        )
+        return iter(rows)
+
+    def __len__(self):
+        """ """
+        return self.store.execute("SELECT COUNT(*) FROM by_country")[0][0]